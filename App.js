@@ -1,11 +1,143 @@
 import React, { useRef, useState } from "react";
 
+// ----------------------------
+// Detection overlay
+// Servers send one binary message per video frame on the "detections" data
+// channel (layout in detection_codec.py). Each message carries the 90 kHz pts
+// the frame was sent with; the frame's RTP timestamp differs from that by a
+// constant offset, which we learn by voting, then draw each frame's own boxes.
+// ----------------------------
+const HEADER_SIZE = 16;
+const RECORD_SIZE = 10;
+const OFFSET_VOTES_NEEDED = 5;
+const MAX_PENDING = 120;
+const CLASSES_RETRY_MS = 1000;
+
+function decodeDetections(buffer) {
+  const view = new DataView(buffer);
+  const count = view.getUint16(2, true);
+  const det = {
+    pts: Number(BigInt.asUintN(32, view.getBigInt64(4, true))),
+    width: view.getUint16(12, true),
+    height: view.getUint16(14, true),
+    boxes: [],
+  };
+  for (let i = 0; i < count; i++) {
+    const o = HEADER_SIZE + i * RECORD_SIZE;
+    det.boxes.push({
+      cls: view.getUint8(o),
+      conf: view.getUint8(o + 1) / 255,
+      x1: view.getUint16(o + 2, true) / 65535,
+      y1: view.getUint16(o + 4, true) / 65535,
+      x2: view.getUint16(o + 6, true) / 65535,
+      y2: view.getUint16(o + 8, true) / 65535,
+    });
+  }
+  return det;
+}
+
+function drawDetections(canvas, video, det, names) {
+  const ctx = canvas.getContext("2d");
+  canvas.width = video.clientWidth;
+  canvas.height = video.clientHeight;
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  if (!det || !video.videoWidth) return;
+
+  // <video> letterboxes the picture (object-fit: contain)
+  const scale = Math.min(canvas.width / video.videoWidth, canvas.height / video.videoHeight);
+  const w = video.videoWidth * scale;
+  const h = video.videoHeight * scale;
+  const left = (canvas.width - w) / 2;
+  const top = (canvas.height - h) / 2;
+
+  ctx.lineWidth = 2;
+  ctx.strokeStyle = "#00ff00";
+  ctx.fillStyle = "#00ff00";
+  ctx.font = "11px sans-serif";
+  for (const b of det.boxes) {
+    const x = left + b.x1 * w;
+    const y = top + b.y1 * h;
+    ctx.strokeRect(x, y, (b.x2 - b.x1) * w, (b.y2 - b.y1) * h);
+    ctx.fillText(`${names[b.cls] ?? b.cls} ${b.conf.toFixed(2)}`, x, Math.max(10, y - 3));
+  }
+}
+
+function attachDetectionOverlay(pc, video, canvas) {
+  const channel = pc.createDataChannel("detections", { ordered: false, maxRetransmits: 0 });
+  channel.binaryType = "arraybuffer";
+
+  let names = [];
+  let namesRequestedAt = 0;
+  let latest = null;
+  let offset = null;
+  let misses = 0;
+  const pending = new Map(); // pts (mod 2^32) -> detections
+  const votes = new Map();
+
+  channel.onmessage = (event) => {
+    if (typeof event.data === "string") {
+      const msg = JSON.parse(event.data);
+      if (msg.type === "classes") names = msg.names;
+      return;
+    }
+    latest = decodeDetections(event.data);
+    // The one-off class list can be lost on this lossy channel: ask again
+    if (names.length === 0 && performance.now() - namesRequestedAt > CLASSES_RETRY_MS) {
+      namesRequestedAt = performance.now();
+      channel.send(JSON.stringify({ type: "classes" }));
+    }
+    pending.set(latest.pts, latest);
+    if (pending.size > MAX_PENDING) pending.delete(pending.keys().next().value);
+  };
+
+  if (!("requestVideoFrameCallback" in HTMLVideoElement.prototype)) {
+    // No per-frame callback: draw whatever arrived last
+    const timer = setInterval(() => drawDetections(canvas, video, latest, names), 33);
+    channel.onclose = () => clearInterval(timer);
+    return channel;
+  }
+
+  const onFrame = (now, metadata) => {
+    const rtp = metadata.rtpTimestamp;
+    if (rtp === undefined) {
+      drawDetections(canvas, video, latest, names);
+    } else if (offset === null) {
+      // Every (frame, message) pair votes for an offset; the true one keeps winning
+      for (const pts of pending.keys()) {
+        const candidate = (rtp - pts) >>> 0;
+        const n = (votes.get(candidate) || 0) + 1;
+        votes.set(candidate, n);
+        if (n >= OFFSET_VOTES_NEEDED) {
+          offset = candidate;
+          votes.clear();
+        }
+      }
+      drawDetections(canvas, video, latest, names);
+    } else {
+      const det = pending.get((rtp - offset) >>> 0);
+      if (det) {
+        misses = 0;
+        drawDetections(canvas, video, det, names);
+      } else if (++misses > MAX_PENDING) {
+        offset = null; // server restarted or stream changed: learn the offset again
+      }
+    }
+    if (channel.readyState !== "closed") video.requestVideoFrameCallback(onFrame);
+  };
+  video.requestVideoFrameCallback(onFrame);
+  return channel;
+}
+
 function App() {
   const yoloVideoRef = useRef(null);
   const piVideoRef = useRef(null);
+  const yoloCanvasRef = useRef(null);
+  const piCanvasRef = useRef(null);
   const yoloPcRef = useRef(null);
   const piPcRef = useRef(null);
+  const piControlRef = useRef(null);
   const [streaming, setStreaming] = useState(false);
+  const [autoFraming, setAutoFraming] = useState(false);
 
   // YOLO WebRTC stream
 async function startYoloStream() {
@@ -26,6 +158,7 @@ async function startYoloStream() {
   };
 
   pc.addTransceiver("video", { direction: "recvonly" });
+  attachDetectionOverlay(pc, yoloVideoRef.current, yoloCanvasRef.current);
 
   const offer = await pc.createOffer();
   await pc.setLocalDescription(offer);
@@ -54,6 +187,17 @@ async function startYoloStream() {
       }
     };
     pc.addTransceiver("video", { direction: "recvonly" });
+    attachDetectionOverlay(pc, piVideoRef.current, piCanvasRef.current);
+
+    // Reliable channel for commands; the Pi answers every "ptz" message with
+    // its current mode, so the toggle only reflects what the Pi confirmed
+    const control = pc.createDataChannel("control");
+    control.onopen = () => control.send(JSON.stringify({ type: "ptz" }));
+    control.onmessage = (event) => {
+      const msg = JSON.parse(event.data);
+      if (msg.type === "ptz") setAutoFraming(msg.mode !== "off");
+    };
+    piControlRef.current = control;
     const offer = await pc.createOffer();
     await pc.setLocalDescription(offer);
 
@@ -78,6 +222,8 @@ async function startYoloStream() {
     if (piPcRef.current) piPcRef.current.close();
     if (yoloVideoRef.current) yoloVideoRef.current.srcObject = null;
     if (piVideoRef.current) piVideoRef.current.srcObject = null;
+    piControlRef.current = null;
+    setAutoFraming(false);
     setStreaming(false);
   }
 
@@ -87,11 +233,17 @@ async function startYoloStream() {
       <div style={{ display: "flex", gap: "10px" }}>
         <div>
           <h3>Pi Camera</h3>
-          <video ref={piVideoRef} autoPlay playsInline muted width={320} height={240} />
+          <div style={{ position: "relative", width: 320, height: 240 }}>
+            <video ref={piVideoRef} autoPlay playsInline muted width={320} height={240} />
+            <canvas ref={piCanvasRef} style={{ position: "absolute", left: 0, top: 0, pointerEvents: "none" }} />
+          </div>
         </div>
         <div>
           <h3>YOLO Processed</h3>
-          <video ref={yoloVideoRef} autoPlay playsInline muted width={320} height={240} />
+          <div style={{ position: "relative", width: 320, height: 240 }}>
+            <video ref={yoloVideoRef} autoPlay playsInline muted width={320} height={240} />
+            <canvas ref={yoloCanvasRef} style={{ position: "absolute", left: 0, top: 0, pointerEvents: "none" }} />
+          </div>
         </div>
       </div>
       <div style={{ marginTop: 10 }}>
@@ -100,6 +252,19 @@ async function startYoloStream() {
         ) : (
           <button onClick={stopStream}>Stop Stream</button>
         )}
+        <button
+          disabled={!streaming}
+          onClick={() => {
+            // Pi crops to recent detections (digital PTZ); boxes stay aligned
+            const mode = autoFraming ? "off" : "auto";
+            const channel = piControlRef.current;
+            if (channel && channel.readyState === "open") {
+              channel.send(JSON.stringify({ type: "ptz", mode }));
+            }
+          }}
+        >
+          {autoFraming ? "Full View" : "Auto Framing"}
+        </button>
       </div>
     </div>
   );
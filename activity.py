@@ -0,0 +1,120 @@
+"""
+Activity-adaptive frame rate for the camera senders (g.py, servecv.py).
+
+Every captured frame is shrunk to a small grey thumbnail and compared with
+the thumbnail from the last time the scene changed. Once nothing has changed
+for IDLE_AFTER seconds the track only hands a frame to the encoder every
+1 / IDLE_FPS seconds, requesting a keyframe every IDLE_KEYFRAME_INTERVAL so
+viewers that join or lose packets while idle recover. Capture and the change
+check keep running at the full rate, so the first frame with motion is sent
+immediately and the track goes back to full rate from there.
+
+Frames that are held back are never encoded or sent, which is where the Pi
+CPU and uplink savings come from. The current mode shows up per session in
+/stats and /metrics (``webrtc_session_sender_idle``) through ``counters``.
+
+    IDLE_FPS=1 IDLE_AFTER=5 python3 g.py      # ADAPTIVE_FPS=0 turns it off
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+ENABLED = os.environ.get("ADAPTIVE_FPS", "1") == "1"
+IDLE_FPS = float(os.environ.get("IDLE_FPS", "1"))
+IDLE_AFTER = float(os.environ.get("IDLE_AFTER", "5"))  # seconds without motion before dropping the rate
+IDLE_KEYFRAME_INTERVAL = 10.0
+THUMB_SIZE = (64, 48)
+MOTION_THRESHOLD = 12  # grey levels a thumbnail pixel must change by to count
+MOTION_AREA = 0.002  # fraction of thumbnail pixels that must change
+VIDEO_CLOCK_RATE = 90000
+
+
+def thumbnail(frame):
+    # Subsample before resizing so the full frame is only touched once;
+    # channel order doesn't matter for spotting change
+    small = cv2.resize(frame[::4, ::4], THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def resync(track, pts):
+    """
+    Restamp a frame after ``track`` held frames back. VideoStreamTrack adds
+    1/30 s per recv() and sleeps to keep that pace, so after an idle gap its
+    clock would lag and the next frames would go out back to back to catch
+    up; move the clock to now instead.
+    """
+    start = getattr(track, "_start", None)
+    if start is None:
+        return pts
+    now_pts = int((time.time() - start) * VIDEO_CLOCK_RATE)
+    if now_pts <= pts:
+        return pts
+    track._timestamp = now_pts
+    return now_pts
+
+
+class ActivityGate:
+    def __init__(self, idle_fps=IDLE_FPS, idle_after=IDLE_AFTER, enabled=ENABLED):
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after
+        self.enabled = enabled
+        self.idle = False
+        self.idle_since = None
+        self.reference = None  # thumbnail from the last change
+        self.last_motion_at = time.monotonic()
+        self.last_sent_at = 0.0
+        self.last_keyframe_at = 0.0
+        self.request_keyframe = None  # the RTCRtpSender's _send_keyframe, once known
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.idle_periods = 0
+
+    def moved(self, frame):
+        thumb = thumbnail(frame)
+        if self.reference is None:
+            self.reference = thumb
+            return True
+        # Compared with the last change rather than the previous frame, so
+        # slow drift adds up until it counts
+        changed = np.count_nonzero(cv2.absdiff(thumb, self.reference) > MOTION_THRESHOLD)
+        if changed <= MOTION_AREA * thumb.size:
+            return False
+        self.reference = thumb
+        return True
+
+    def admit(self, frame, now=None):
+        """True if ``frame`` should be sent; False to drop it and capture the next one."""
+        if not self.enabled:
+            self.frames_sent += 1
+            return True
+        now = time.monotonic() if now is None else now
+
+        if self.moved(frame):
+            self.last_motion_at = now
+            if self.idle:
+                self.idle = False
+                print(f"🎬 Motion after {now - self.idle_since:.0f}s idle: back to full frame rate")
+        elif not self.idle and now - self.last_motion_at >= self.idle_after:
+            self.idle = True
+            self.idle_since = now
+            self.idle_periods += 1
+            print(f"💤 No motion for {self.idle_after:g}s: dropping to {self.idle_fps:g} fps")
+
+        if self.idle:
+            if now - self.last_sent_at < 1.0 / self.idle_fps:
+                self.frames_skipped += 1
+                return False
+            if self.request_keyframe is not None and now - self.last_keyframe_at >= IDLE_KEYFRAME_INTERVAL:
+                # Applies to this frame: aiortc reads the flag after recv() returns
+                self.request_keyframe()
+                self.last_keyframe_at = now
+        self.last_sent_at = now
+        self.frames_sent += 1
+        return True
+
+    def counters(self):
+        """Per-session numbers for peer_stats.track()."""
+        return {"idle": int(self.idle), "frames_sent": self.frames_sent,
+                "frames_skipped": self.frames_skipped, "idle_periods": self.idle_periods}
@@ -0,0 +1,186 @@
+"""
+Opt-in allocation and frame-copy accounting for the video hot paths.
+
+Set ALLOC_PROFILE=1 to turn it on; otherwise every helper here is a plain
+numpy/PyAV call behind one boolean check.
+
+Two kinds of evidence are collected per pipeline stage:
+
+* exact counts from the wrapped buffer helpers (copy_frame, new_frame,
+  to_ndarray, from_ndarray): how many full frames were copied or allocated
+  and how many bytes that was;
+* sampled tracemalloc measurements from ``with stage("name"):`` blocks:
+  every ALLOC_SAMPLE_EVERY-th entry records the traced-memory peak above the
+  starting point, which catches allocations the helpers don't see (OpenCV,
+  ultralytics). tracemalloc is process-wide, so with several threads busy
+  these numbers are estimates, not exact per-stage figures.
+
+report() returns everything plus the top allocation sites from a
+tracemalloc snapshot; install(app) serves it on /debug/alloc.
+"""
+import contextlib
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+ENABLED = os.environ.get("ALLOC_PROFILE") == "1"
+SAMPLE_EVERY = int(os.environ.get("ALLOC_SAMPLE_EVERY", "10"))
+TRACE_FRAMES = 8
+
+_lock = threading.Lock()
+_stages = defaultdict(lambda: {
+    "calls": 0, "sampled": 0, "sampled_peak_bytes": 0,
+    "copies": 0, "copy_bytes": 0, "allocs": 0, "alloc_bytes": 0,
+})
+_COUNTERS = {"copy": ("copies", "copy_bytes"), "alloc": ("allocs", "alloc_bytes")}
+_started_at = time.time()
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+
+
+if ENABLED:
+    enable()
+
+
+def _count(stage_name, kind, nbytes):
+    with _lock:
+        s = _stages[stage_name]
+        count, total = _COUNTERS[kind]
+        s[count] += 1
+        s[total] += nbytes
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Attribute allocations inside the block to ``name`` (sampled)."""
+    if not ENABLED:
+        yield
+        return
+    with _lock:
+        s = _stages[name]
+        s["calls"] += 1
+        sampled = s["calls"] % SAMPLE_EVERY == 0
+    if not sampled:
+        yield
+        return
+    start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        with _lock:
+            s["sampled"] += 1
+            s["sampled_peak_bytes"] += max(0, peak - start)
+
+
+# ----------------------------
+# Wrapped buffer helpers
+# ----------------------------
+def copy_frame(arr, stage_name):
+    if ENABLED:
+        _count(stage_name, "copy", arr.nbytes)
+    return arr.copy()
+
+
+def new_frame(shape, stage_name, fill=0, dtype=np.uint8):
+    arr = np.full(shape, fill, dtype=dtype)
+    if ENABLED:
+        _count(stage_name, "alloc", arr.nbytes)
+    return arr
+
+
+def to_ndarray(frame, stage_name, **kwargs):
+    """av.VideoFrame.to_ndarray: a conversion plus a fresh array."""
+    arr = frame.to_ndarray(**kwargs)
+    if ENABLED:
+        _count(stage_name, "alloc", arr.nbytes)
+    return arr
+
+
+def from_ndarray(arr, stage_name, format="bgr24"):
+    """av.VideoFrame.from_ndarray: always copies the pixels into a new AVFrame."""
+    from av import VideoFrame
+
+    if ENABLED:
+        _count(stage_name, "copy", arr.nbytes)
+    return VideoFrame.from_ndarray(arr, format=format)
+
+
+# ----------------------------
+# Reporting
+# ----------------------------
+def top_sites(limit=15):
+    if not tracemalloc.is_tracing():
+        return []
+    here = os.path.dirname(os.path.abspath(__file__))
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    sites = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        sites.append({
+            "site": f"{os.path.relpath(frame.filename, here)}:{frame.lineno}",
+            "bytes": stat.size,
+            "blocks": stat.count,
+        })
+    return sites
+
+
+def report(limit=15):
+    elapsed = max(time.time() - _started_at, 1e-6)
+    with _lock:
+        stages = {}
+        for name, s in sorted(_stages.items()):
+            per_sample = s["sampled_peak_bytes"] / s["sampled"] if s["sampled"] else 0
+            stages[name] = {
+                **s,
+                "est_alloc_bytes_per_call": int(per_sample),
+                "frame_bytes_per_sec": int((s["copy_bytes"] + s["alloc_bytes"]) / elapsed),
+            }
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        "enabled": ENABLED,
+        "seconds": round(elapsed, 1),
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "stages": stages,
+        "top_sites": top_sites(limit) if ENABLED else [],
+    }
+
+
+def format_report(limit=10):
+    r = report(limit)
+    lines = [f"Allocation report over {r['seconds']}s (sampling 1/{SAMPLE_EVERY}):"]
+    for name, s in r["stages"].items():
+        lines.append(
+            f"  {name:<16} copies {s['copies']:>7} ({s['copy_bytes'] / 1e6:9.1f} MB)  "
+            f"allocs {s['allocs']:>7} ({s['alloc_bytes'] / 1e6:9.1f} MB)  "
+            f"~{s['est_alloc_bytes_per_call'] / 1e3:8.1f} kB/call  "
+            f"{s['frame_bytes_per_sec'] / 1e6:7.1f} MB/s"
+        )
+    for site in r["top_sites"]:
+        lines.append(f"  {site['bytes'] / 1e6:8.2f} MB in {site['blocks']:>6} blocks  {site['site']}")
+    return "\n".join(lines)
+
+
+def install(app):
+    """Serve report() on /debug/alloc of a Quart app."""
+    from quart import jsonify, request
+
+    @app.route("/debug/alloc")
+    async def debug_alloc():
+        return jsonify(report(int(request.args.get("limit", 15))))
+
+    return app
@@ -0,0 +1,77 @@
+"""
+Shared pieces of the inference tier (coordinator.py + inference_worker.py).
+
+Streams are placed with consistent hashing with bounded loads: a stream
+goes to the first worker clockwise from its hash on the ring that is still
+under its load bound. Adding or losing a worker only moves the streams that
+have to move, and no worker ends up with much more than its share.
+"""
+import bisect
+import hashlib
+
+import aiohttp
+
+HTTP_TIMEOUT = 5.0
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, vnodes=64):
+        self.vnodes = vnodes
+        self._keys = []
+        self._nodes = []
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        for i in range(self.vnodes):
+            h = ring_hash(f"{node}#{i}")
+            idx = bisect.bisect(self._keys, h)
+            self._keys.insert(idx, h)
+            self._nodes.insert(idx, node)
+
+    def remove(self, node):
+        keep = [(k, n) for k, n in zip(self._keys, self._nodes) if n != node]
+        self._keys = [k for k, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def nodes(self):
+        return set(self._nodes)
+
+    def walk(self, key):
+        """Distinct nodes in ring order, starting from ``key``'s position."""
+        if not self._keys:
+            return
+        start = bisect.bisect(self._keys, ring_hash(key))
+        seen = set()
+        for i in range(len(self._keys)):
+            node = self._nodes[(start + i) % len(self._keys)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+
+
+async def post_json(url, payload):
+    timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.post(url, json=payload) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+
+async def get_json(url):
+    timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+
+async def delete(url):
+    timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.delete(url) as resp:
+            resp.raise_for_status()
@@ -0,0 +1,250 @@
+# Coordinator for the inference tier: cameras register here, streams are
+# assigned to inference_worker.py processes, viewers can ask any node.
+#
+#   python3 coordinator.py --spawn-workers 3      # everything on this machine
+#   curl -X POST localhost:7000/sources -H 'Content-Type: application/json' \
+#        -d '{"stream_id": "pi-1", "offer_url": "http://192.168.4.117:5000/offer"}'
+#   browser: POST /streams/pi-1/offer to the coordinator or any worker
+import argparse
+import asyncio
+import math
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from quart import Quart, request, jsonify
+from quart_cors import cors
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+
+from cluster import HashRing, post_json, delete
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+
+HEARTBEAT_TIMEOUT = 10.0
+REBALANCE_INTERVAL = 5.0
+LOAD_FACTOR = 1.25  # no worker gets more than ceil(its share * 1.25) streams
+HIGH_WATER = 0.9  # model busy this fraction of the time -> shed a stream
+LOW_WATER = 0.6  # ...as long as some other worker is below this
+
+workers = {}  # worker_id -> {"url", "capacity", "utilization", "last_seen"}
+sources = {}  # stream_id -> {"offer_url"}
+assignments = {}  # stream_id -> worker_id
+ring = HashRing()
+rebalance_lock = asyncio.Lock()
+
+
+def live_workers():
+    now = time.monotonic()
+    return [w for w, info in workers.items() if now - info["last_seen"] < HEARTBEAT_TIMEOUT]
+
+
+def plan():
+    """Target stream -> worker placement (consistent hashing with bounded loads)."""
+    live = live_workers()
+    if not live:
+        return {}
+    total_capacity = sum(workers[w]["capacity"] for w in live)
+    bound = {w: math.ceil(len(sources) * LOAD_FACTOR * workers[w]["capacity"] / total_capacity)
+             for w in live}
+
+    # Load-aware: an overloaded worker sheds one stream per pass while someone has headroom
+    current = defaultdict(int)
+    for w in assignments.values():
+        current[w] += 1
+    if any(workers[w]["utilization"] < LOW_WATER for w in live):
+        for w in live:
+            if workers[w]["utilization"] > HIGH_WATER:
+                bound[w] = min(bound[w], max(current[w] - 1, 0))
+
+    def rank(sid, w):
+        return next(i for i, node in enumerate(ring.walk(sid)) if node == w)
+
+    counts = defaultdict(int)
+    target = {}
+    # Keep placements that are still valid, ring-preferred ones first, to avoid churn
+    kept = [(sid, w) for sid, w in assignments.items() if sid in sources and w in bound]
+    for sid, w in sorted(kept, key=lambda item: rank(*item)):
+        if counts[w] < bound[w]:
+            target[sid] = w
+            counts[w] += 1
+    for sid in sorted(sources):
+        if sid in target:
+            continue
+        for w in ring.walk(sid):
+            if w in bound and counts[w] < bound[w]:
+                target[sid] = w
+                counts[w] += 1
+                break
+    return target
+
+
+async def rebalance():
+    async with rebalance_lock:
+        live = set(live_workers())
+        for w in ring.nodes() - live:
+            print(f"💀 Worker {w} missed heartbeats, reassigning its streams")
+            ring.remove(w)
+
+        target = plan()
+        for sid, w in target.items():
+            old = assignments.get(sid)
+            if old == w:
+                continue
+            # Make before break: start on the new worker, then stop the old one
+            try:
+                await post_json(f"{workers[w]['url']}/streams",
+                                {"stream_id": sid, "offer_url": sources[sid]["offer_url"]})
+            except Exception as e:
+                print(f"❌ Could not start {sid} on {w}: {e}")
+                continue
+            assignments[sid] = w
+            print(f"📦 {sid}: {old} -> {w}")
+            if old in live:
+                await drop_stream(old, sid)
+
+        for sid in [s for s in assignments if s not in sources or s not in target]:
+            old = assignments.pop(sid)
+            if old in live:
+                await drop_stream(old, sid)
+
+
+async def drop_stream(worker_id, stream_id):
+    try:
+        await delete(f"{workers[worker_id]['url']}/streams/{stream_id}")
+    except Exception as e:
+        print(f"⚠️ Could not stop {stream_id} on {worker_id}: {e}")
+
+
+async def rebalance_loop():
+    while True:
+        await asyncio.sleep(REBALANCE_INTERVAL)
+        try:
+            await rebalance()
+        except Exception as e:
+            print(f"⚠️ Rebalance failed: {e}")
+
+
+# ----------------------------
+# Workers
+# ----------------------------
+@app.route("/workers/heartbeat", methods=["POST"])
+async def heartbeat():
+    body = await request.get_json()
+    worker_id = body["worker_id"]
+    if worker_id not in ring.nodes():
+        print(f"🆕 Worker {worker_id} at {body['url']}")
+    workers[worker_id] = {
+        "url": body["url"],
+        "capacity": body.get("capacity", 1),
+        "utilization": body.get("utilization", 0.0),
+        "last_seen": time.monotonic(),
+    }
+    ring.add(worker_id)
+
+    # Adopt what workers are running so a coordinator restart loses nothing,
+    # and tell them to drop anything that now lives elsewhere
+    drop = []
+    for stream in body.get("streams", []):
+        sid = stream["stream_id"]
+        sources.setdefault(sid, {"offer_url": stream["offer_url"]})
+        owner = assignments.setdefault(sid, worker_id)
+        if owner != worker_id:
+            drop.append(sid)
+    return jsonify({"drop": drop})
+
+
+@app.route("/workers")
+async def list_workers():
+    now = time.monotonic()
+    live = set(live_workers())
+    return jsonify({
+        w: {**info, "last_seen": round(now - info["last_seen"], 3), "live": w in live,
+            "streams": sorted(s for s, a in assignments.items() if a == w)}
+        for w, info in workers.items()
+    })
+
+
+# ----------------------------
+# Sources and streams
+# ----------------------------
+@app.route("/sources", methods=["POST"])
+async def register_source():
+    body = await request.get_json()
+    sources[body["stream_id"]] = {"offer_url": body["offer_url"]}
+    await rebalance()
+    return jsonify({"stream_id": body["stream_id"], "worker": assignments.get(body["stream_id"])})
+
+
+@app.route("/sources/<stream_id>", methods=["DELETE"])
+async def unregister_source(stream_id):
+    sources.pop(stream_id, None)
+    await rebalance()
+    return jsonify({"status": "removed"})
+
+
+@app.route("/streams")
+async def list_streams():
+    return jsonify({sid: stream_info(sid) for sid in sources})
+
+
+@app.route("/streams/<stream_id>")
+async def get_stream(stream_id):
+    if stream_id not in sources:
+        return jsonify({"error": "unknown stream"}), 404
+    return jsonify(stream_info(stream_id))
+
+
+def stream_info(stream_id):
+    worker_id = assignments.get(stream_id)
+    return {
+        "stream_id": stream_id,
+        "offer_url": sources[stream_id]["offer_url"],
+        "worker": worker_id,
+        "worker_url": workers[worker_id]["url"] if worker_id else None,
+    }
+
+
+@app.route("/streams/<stream_id>/offer", methods=["POST"])
+async def stream_offer(stream_id):
+    worker_id = assignments.get(stream_id)
+    if worker_id is None:
+        return jsonify({"error": "stream not assigned"}), 503
+    params = await request.get_json()
+    # Media flows from the worker straight to the browser; only signaling is proxied
+    return jsonify(await post_json(f"{workers[worker_id]['url']}/streams/{stream_id}/offer", params))
+
+
+def spawn_workers(count, base_port, coordinator_url):
+    return [
+        subprocess.Popen([sys.executable, "inference_worker.py",
+                          "--port", str(base_port + i), "--coordinator", coordinator_url,
+                          "--advertise", "127.0.0.1"])
+        for i in range(count)
+    ]
+
+
+async def main(args):
+    asyncio.create_task(rebalance_loop())
+    config = Config()
+    config.bind = [f"0.0.0.0:{args.port}"]
+    print(f"🚀 Coordinator starting on 0.0.0.0:{args.port}")
+    await serve(app, config)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--spawn-workers", type=int, default=0,
+                        help="also start this many local inference_worker.py processes")
+    parser.add_argument("--worker-base-port", type=int, default=8100)
+    args = parser.parse_args()
+
+    children = spawn_workers(args.spawn_workers, args.worker_base_port, f"http://127.0.0.1:{args.port}")
+    try:
+        asyncio.run(main(args))
+    finally:
+        for child in children:
+            child.terminate()
@@ -0,0 +1,127 @@
+"""
+Compact binary encoding for per-frame detections sent over RTCDataChannel.
+
+One message per video frame, little-endian:
+
+    header  (16 bytes)  u8 version, u8 flags, u16 count, i64 pts,
+                        u16 frame width, u16 frame height
+    record  (10 bytes)  u8 class id, u8 confidence (0-255),
+                        u16 x1, u16 y1, u16 x2, u16 y2   (box / frame size * 65535)
+
+``pts`` is the 90 kHz media timestamp the frame was sent with, so the
+browser can line a message up with the frame it describes (the RTP
+timestamp of that frame differs from it by a constant offset). Class names
+are sent once as a JSON text message: {"type": "classes", "names": [...]};
+a viewer that missed it (the channel is lossy) sends {"type": "classes"}
+and gets it again.
+
+The detections channel is unordered with no retransmits, so commands that
+must arrive (PTZ mode changes) go on a reliable "control" channel the
+browser opens next to it; JSON on either one reaches ``on_control``.
+"""
+import json
+import struct
+
+VERSION = 1
+HEADER = struct.Struct("<BBHqHH")
+RECORD = struct.Struct("<BBHHHH")
+CHANNEL_LABEL = "detections"
+CONTROL_LABEL = "control"
+
+
+def encode(pts, width, height, xyxy, classes, confidences):
+    count = len(classes)
+    out = bytearray(HEADER.size + RECORD.size * count)
+    HEADER.pack_into(out, 0, VERSION, 0, count, int(pts), width, height)
+    sx, sy = 65535 / max(width, 1), 65535 / max(height, 1)
+    offset = HEADER.size
+    for (x1, y1, x2, y2), cls_id, conf in zip(xyxy, classes, confidences):
+        RECORD.pack_into(
+            out, offset, int(cls_id) & 0xFF, min(255, int(round(float(conf) * 255))),
+            _q(x1 * sx), _q(y1 * sy), _q(x2 * sx), _q(y2 * sy),
+        )
+        offset += RECORD.size
+    return bytes(out)
+
+
+def _q(value):
+    return max(0, min(65535, int(round(float(value)))))
+
+
+def decode(data):
+    """Inverse of encode(): returns (pts, width, height, [(cls, conf, x1, y1, x2, y2), ...])."""
+    version, _flags, count, pts, width, height = HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError(f"unsupported detection message version {version}")
+    boxes = []
+    for i in range(count):
+        cls_id, conf, x1, y1, x2, y2 = RECORD.unpack_from(data, HEADER.size + i * RECORD.size)
+        boxes.append((cls_id, conf / 255, x1 * width / 65535, y1 * height / 65535,
+                      x2 * width / 65535, y2 * height / 65535))
+    return pts, width, height, boxes
+
+
+def classes_message(names):
+    if isinstance(names, dict):
+        names = [names[i] for i in sorted(names)]
+    return json.dumps({"type": "classes", "names": list(names)})
+
+
+class DetectionChannels:
+    """The open detection data channels of one stream's viewers."""
+
+    def __init__(self, on_control=None):
+        self.channels = set()
+        self.names = None
+        self.sent = 0
+        # Called with (message dict, channel) for JSON text the peer sends,
+        # e.g. placement.py's control messages
+        self.on_control = on_control
+
+    def attach(self, pc):
+        @pc.on("datachannel")
+        def on_datachannel(channel):
+            if channel.label not in (CHANNEL_LABEL, CONTROL_LABEL):
+                return
+
+            @channel.on("message")
+            def on_message(message):
+                if not isinstance(message, str):
+                    return
+                msg = json.loads(message)
+                if msg.get("type") == "classes":
+                    if self.names is not None and channel.readyState == "open":
+                        channel.send(classes_message(self.names))
+                elif self.on_control is not None:
+                    self.on_control(msg, channel)
+
+            if channel.label == CONTROL_LABEL:
+                return
+            self.channels.add(channel)
+            if self.names is not None:
+                channel.send(classes_message(self.names))
+
+            @channel.on("close")
+            def on_close():
+                self.channels.discard(channel)
+
+    def set_names(self, names):
+        if names is not None and self.names is None:
+            self.names = names
+            for channel in list(self.channels):
+                channel.send(classes_message(names))
+
+    def send_json(self, msg):
+        text = json.dumps(msg)
+        for channel in list(self.channels):
+            if channel.readyState == "open":
+                channel.send(text)
+
+    def broadcast(self, pts, width, height, xyxy, classes, confidences):
+        if not self.channels:
+            return
+        message = encode(pts, width, height, xyxy, classes, confidences)
+        for channel in list(self.channels):
+            if channel.readyState == "open":
+                channel.send(message)
+                self.sent += 1
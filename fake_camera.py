@@ -0,0 +1,119 @@
+"""
+Stand-in for picamera2.Picamera2 so the Pi servers can run off-device.
+
+Implements the part of the API the servers use: create_preview_configuration,
+configure, start/stop, capture_array and capture_request (make_array /
+release) for "main" and "lores" streams, and the ScalerCrop control. Frames
+are a moving test pattern drawn at SENSOR_SIZE, cropped by ScalerCrop and
+scaled to each stream; "RGB888"/"BGR888" give HxWx3 arrays and "YUV420"
+gives the (H*3/2)xW I420 layout Picamera2 uses for lores.
+
+    FAKE_CAMERA=1 python3 webrtcwithyoloandflask.py
+"""
+import time
+
+import cv2
+import numpy as np
+
+SENSOR_SIZE = (2304, 1296)
+
+
+class FakeRequest:
+    def __init__(self, camera, index):
+        self.camera = camera
+        self.index = index
+        self.crop = camera.controls["ScalerCrop"]
+
+    def make_array(self, name):
+        return self.camera.render(name, self.index, self.crop)
+
+    def get_metadata(self):
+        return {"SensorTimestamp": int(time.monotonic_ns()), "FrameIndex": self.index,
+                "ScalerCrop": self.crop}
+
+    def release(self):
+        pass
+
+
+class FakePicamera2:
+    def __init__(self, framerate=30):
+        self.framerate = framerate
+        self.config = None
+        self.started_at = None
+        full = (0, 0, *SENSOR_SIZE)
+        self.camera_controls = {"ScalerCrop": ((0, 0, 64, 64), full, full)}
+        self.camera_properties = {"ScalerCropMaximum": full, "PixelArraySize": SENSOR_SIZE}
+        self.controls = {"ScalerCrop": full}
+        self._sensor = (None, None)  # (frame index, full-sensor image)
+
+    def create_preview_configuration(self, main=None, lores=None, **kwargs):
+        config = {"main": dict(main or {"format": "RGB888", "size": (640, 480)})}
+        if lores is not None:
+            config["lores"] = dict(lores)
+        config.update(kwargs)
+        return config
+
+    create_video_configuration = create_preview_configuration
+
+    def configure(self, config):
+        self.config = config
+
+    def set_controls(self, controls):
+        if "ScalerCrop" in controls:
+            x, y, w, h = (int(v) for v in controls["ScalerCrop"])
+            sw, sh = SENSOR_SIZE
+            w, h = max(64, min(w, sw)), max(64, min(h, sh))
+            controls = {**controls, "ScalerCrop": (max(0, min(x, sw - w)), max(0, min(y, sh - h)), w, h)}
+        self.controls.update(controls)
+
+    def start(self):
+        self.started_at = time.monotonic()
+
+    def stop(self):
+        self.started_at = None
+
+    def close(self):
+        self.stop()
+
+    def _wait_frame(self):
+        # Pace like a real sensor: block until the next frame is due
+        elapsed = time.monotonic() - self.started_at
+        index = int(elapsed * self.framerate) + 1
+        time.sleep(max(0.0, index / self.framerate - elapsed))
+        return index
+
+    def capture_request(self):
+        return FakeRequest(self, self._wait_frame())
+
+    def capture_array(self, name="main"):
+        return self.render(name, self._wait_frame(), self.controls["ScalerCrop"])
+
+    def _sensor_image(self, index):
+        # The scene, drawn once per frame at sensor resolution
+        if self._sensor[0] == index:
+            return self._sensor[1]
+        sw, sh = SENSOR_SIZE
+        img = np.full((sh, sw, 3), 40, dtype=np.uint8)
+        t = index / self.framerate
+        bw, bh = sw // 6, sh // 4
+        x = int((sw - bw) * (0.5 + 0.5 * np.sin(t * 0.7)))
+        y = int((sh - bh) * (0.5 + 0.5 * np.cos(t * 0.5)))
+        cv2.rectangle(img, (x, y), (x + bw, y + bh), (60, 160, 230), -1)
+        self._sensor = (index, img)
+        return img
+
+    def render(self, name, index, crop):
+        stream = self.config[name]
+        width, height = stream["size"]
+        fmt = stream.get("format", "RGB888")
+
+        # Every stream shows the same ScalerCrop region of the sensor
+        x, y, w, h = crop
+        img = cv2.resize(self._sensor_image(index)[y:y + h, x:x + w], (width, height),
+                         interpolation=cv2.INTER_AREA)
+        cv2.putText(img, f"FAKE {name} #{index}", (10, max(20, height // 12)),
+                    cv2.FONT_HERSHEY_SIMPLEX, max(0.4, width / 1280), (255, 255, 255), 2)
+
+        if fmt == "YUV420":
+            return cv2.cvtColor(img, cv2.COLOR_BGR2YUV_I420)
+        return img
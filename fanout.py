@@ -0,0 +1,267 @@
+"""
+Encode-once fan-out of a processed stream to many WebRTC viewers (SFU-style).
+
+Normally every viewer's RTCRtpSender runs its own VP8 encoder on the same
+frames. Here each configured quality layer is encoded once with PyAV and the
+resulting av.Packets are handed to every subscribed track; aiortc only
+packetizes packets it is given (RTCRtpSender skips its encoder for non-Frame
+data), so 10 viewers cost one encode per layer instead of ten. Layers keep the
+source's aspect ratio and never upscale: the largest is capped at the source
+resolution, and a layer the source is too small to fill is skipped with its
+viewers moved to the largest.
+
+Keyframes: a PLI from any viewer is routed (by overriding that sender's
+_send_keyframe) to its layer, and requests arriving within
+KEYFRAME_MIN_INTERVAL of the last keyframe are coalesced into it. A viewer
+that falls too far behind is cut back to the next keyframe instead of
+receiving a broken reference chain.
+
+Listeners registered in ``listeners`` are called as
+``listener(pts, width, height, meta)`` for every frame handed to the
+encoders, with the 90 kHz pts the frame is sent with; this is how per-frame
+metadata (detections) is kept aligned with the video.
+"""
+import asyncio
+import fractions
+import time
+
+import av
+from aiortc.mediastreams import MediaStreamError, MediaStreamTrack
+
+import alloc_profiler
+
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+KEYFRAME_MIN_INTERVAL = 0.5  # seconds; PLIs inside this window share one keyframe
+KEYFRAME_INTERVAL = 10.0  # periodic keyframe so late joiners never wait long
+IDLE_REFRESH = 1.0  # re-encode the last frame this often when nothing new arrives
+SUBSCRIBER_QUEUE = 30  # packets a slow viewer may lag before being resynced
+
+# (name, max width, max height, bitrate at that size); each layer keeps the
+# source's aspect ratio inside its box and never exceeds the source resolution
+DEFAULT_LAYERS = [
+    ("high", 1280, 720, 1_500_000),
+    ("low", 640, 360, 400_000),
+]
+
+
+class FanoutTrack(MediaStreamTrack):
+    """One viewer's view of a layer: yields the shared encoded packets."""
+    kind = "video"
+
+    def __init__(self, layer):
+        super().__init__()
+        self.layer = layer
+        self.queue = asyncio.Queue()
+        self.waiting_for_keyframe = True
+        self.sent = 0
+        self.resyncs = 0
+
+    def offer(self, packet):
+        if self.waiting_for_keyframe:
+            if not packet.is_keyframe:
+                return
+            self.waiting_for_keyframe = False
+        if self.queue.qsize() >= SUBSCRIBER_QUEUE:
+            # Too far behind: drop the backlog and restart from a keyframe
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.waiting_for_keyframe = True
+            self.resyncs += 1
+            self.layer.request_keyframe()
+            return
+        self.queue.put_nowait(packet)
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        packet = await self.queue.get()
+        if packet is None:
+            raise MediaStreamError
+        self.sent += 1
+        return packet
+
+    def stop(self):
+        super().stop()
+        self.layer.subscribers.discard(self)
+        self.queue.put_nowait(None)
+
+
+class EncodedLayer:
+    def __init__(self, name, width, height, bitrate, fps=30):
+        self.name = name
+        self.max_width = width
+        self.max_height = height
+        self.max_bitrate = bitrate
+        self.width = width
+        self.height = height
+        self.bitrate = bitrate
+        self.fps = fps
+        self.skipped = False  # only upscaling could fill this layer at the current source size
+        self.subscribers = set()
+        self.codec = None
+
+        self.keyframe_requested = True
+        self.last_keyframe_at = 0.0
+        self.keyframe_requests = 0
+        self.keyframes = 0
+        self.frames = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+
+    def _open(self):
+        codec = av.CodecContext.create("libvpx", "w")
+        codec.width = self.width
+        codec.height = self.height
+        codec.pix_fmt = "yuv420p"
+        codec.bit_rate = self.bitrate
+        codec.time_base = VIDEO_TIME_BASE
+        codec.framerate = fractions.Fraction(self.fps, 1)
+        codec.gop_size = int(self.fps * KEYFRAME_INTERVAL)
+        codec.options = {
+            "deadline": "realtime",
+            "cpu-used": "8",
+            "lag-in-frames": "0",
+            "error-resilient": "1",
+            "auto-alt-ref": "0",
+        }
+        self.codec = codec
+
+    def fit(self, width, height, largest=False):
+        """
+        Size the layer for a width x height source. Returns False when the box
+        is at least the source size, i.e. the layer would only upscale; the
+        ``largest`` layer is capped at the source resolution instead.
+        """
+        scale = min(self.max_width / width, self.max_height / height)
+        if scale >= 1 and not largest:
+            return False
+        scale = min(scale, 1.0)
+        size = (max(2, int(width * scale) & ~1), max(2, int(height * scale) & ~1))
+        if size != (self.width, self.height):
+            self.width, self.height = size
+            # Same bits per pixel as configured for the full box
+            self.bitrate = int(self.max_bitrate * size[0] * size[1] / (self.max_width * self.max_height))
+            self.codec = None  # reopened at the new size; its first frame is a keyframe
+        return True
+
+    def request_keyframe(self):
+        self.keyframe_requests += 1
+        self.keyframe_requested = True
+
+    def encode(self, img, pts):
+        """BGR ndarray or av.VideoFrame -> list of av.Packet. Blocking; run in a thread."""
+        if self.codec is None:
+            self._open()
+        if not isinstance(img, av.VideoFrame):
+            img = alloc_profiler.from_ndarray(img, "encode", format="bgr24")
+        frame = img.reformat(width=self.width, height=self.height, format="yuv420p")
+        frame.pts = pts
+        frame.time_base = VIDEO_TIME_BASE
+
+        now = time.monotonic()
+        if self.keyframe_requested and now - self.last_keyframe_at >= KEYFRAME_MIN_INTERVAL:
+            frame.pict_type = av.video.frame.PictureType.I
+            self.keyframe_requested = False
+
+        t0 = time.perf_counter()
+        packets = self.codec.encode(frame)
+        self.encode_seconds += time.perf_counter() - t0
+        self.frames += 1
+        for packet in packets:
+            packet.time_base = VIDEO_TIME_BASE
+            self.bytes += packet.size
+            if packet.is_keyframe:
+                self.keyframes += 1
+                self.last_keyframe_at = now
+        return packets
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "size": f"{self.width}x{self.height}",
+            "bitrate": self.bitrate,
+            "skipped": self.skipped,
+            "subscribers": len(self.subscribers),
+            "frames_encoded": self.frames,
+            "bytes": self.bytes,
+            "encode_seconds": round(self.encode_seconds, 3),
+            "keyframe_requests": self.keyframe_requests,
+            "keyframes": self.keyframes,
+        }
+
+
+class EncodedFanout:
+    def __init__(self, frames, layers=DEFAULT_LAYERS, placeholder=None):
+        """
+        ``frames`` is a LatestMailbox of ``(image, meta)`` pairs, where image is a
+        BGR ndarray or an av.VideoFrame (e.g. processed_frames).
+        """
+        self.frames = frames
+        self.listeners = []
+        self.layers = {name: EncodedLayer(name, w, h, bitrate) for name, w, h, bitrate in layers}
+        self.default_layer = next(iter(self.layers))
+        self.largest = max(self.layers.values(), key=lambda layer: layer.max_width * layer.max_height)
+        self.source_size = None
+        self.placeholder = placeholder
+        self.started_at = time.monotonic()
+
+    def has_subscribers(self):
+        return any(layer.subscribers for layer in self.layers.values())
+
+    def subscribe(self, pc, layer_name=None):
+        """Add a viewer track for ``layer_name`` (default: first layer) to ``pc``."""
+        layer = self.layers.get(layer_name) or self.layers[self.default_layer]
+        if layer.skipped:
+            layer = self.largest
+        track = FanoutTrack(layer)
+        sender = pc.addTrack(track)
+        # aiortc calls sender._send_keyframe() on PLI; route it to the shared encoder
+        sender._send_keyframe = lambda: track.layer.request_keyframe()
+        layer.subscribers.add(track)
+        layer.request_keyframe()  # a new viewer needs a keyframe to start decoding
+        return track
+
+    def _fit(self, width, height):
+        for layer in self.layers.values():
+            layer.skipped = not layer.fit(width, height, largest=layer is self.largest)
+            if not layer.skipped:
+                continue
+            # Its viewers get the source resolution instead of an upscaled copy
+            for track in list(layer.subscribers):
+                layer.subscribers.discard(track)
+                track.layer = self.largest
+                track.waiting_for_keyframe = True
+                self.largest.subscribers.add(track)
+                self.largest.request_keyframe()
+
+    async def run(self):
+        seq = 0
+        img, meta = self.placeholder, None
+        while True:
+            try:
+                seq, (img, meta) = await asyncio.wait_for(self.frames.wait_newer(seq), timeout=IDLE_REFRESH)
+            except asyncio.TimeoutError:
+                pass  # keep viewers fed (and keyframes flowing) while the source is quiet
+            if img is None or not self.has_subscribers():
+                continue
+            pts = int((time.monotonic() - self.started_at) * VIDEO_CLOCK_RATE)
+            if isinstance(img, av.VideoFrame):
+                width, height = img.width, img.height
+            else:
+                height, width = img.shape[:2]
+            if (width, height) != self.source_size:
+                self.source_size = (width, height)
+                self._fit(width, height)
+            for listener in self.listeners:
+                listener(pts, width, height, meta)
+            for layer in self.layers.values():
+                if not layer.subscribers:
+                    continue
+                packets = await asyncio.to_thread(layer.encode, img, pts)
+                for packet in packets:
+                    for track in list(layer.subscribers):
+                        track.offer(packet)
+
+    def stats(self):
+        return {name: layer.stats() for name, layer in self.layers.items()}
@@ -0,0 +1,69 @@
+"""
+Single-slot "latest value" channel for passing frames between coroutines.
+
+Producers ``publish()`` without ever blocking; a newer value simply replaces
+an older one, and is counted in ``dropped`` if no consumer ever saw it. A consumer that wants every
+value at most once awaits ``take()``; readers that just want the newest value
+(e.g. one per viewer) use ``latest`` or await ``wait_newer(seq)``. Waiters are
+woken by an event rather than polling, so an idle pipeline costs nothing.
+
+Everything here must be called from the event loop thread.
+"""
+import asyncio
+
+
+class LatestMailbox:
+    def __init__(self, name=None):
+        self.name = name
+        self.value = None
+        self.seq = 0
+        self.published = 0
+        self.consumed = 0
+        self.dropped = 0
+        self._fresh = False
+        self._observed = 0  # newest seq handed to any consumer
+        self._changed = asyncio.Event()
+
+    def publish(self, value):
+        if self.seq > self._observed:
+            self.dropped += 1
+        self.value = value
+        self.seq += 1
+        self.published += 1
+        self._fresh = True
+        # Wake everyone waiting on this generation, then start a new one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    @property
+    def latest(self):
+        return self.value
+
+    def has_new(self):
+        return self._fresh
+
+    async def take(self):
+        """Wait for a value that hasn't been taken yet, and take it."""
+        while not self._fresh:
+            await self._changed.wait()
+        self._fresh = False
+        self._observed = self.seq
+        self.consumed += 1
+        return self.value
+
+    async def wait_newer(self, seq):
+        """Wait until something newer than ``seq`` is published; returns ``(seq, value)``."""
+        while self.seq <= seq:
+            await self._changed.wait()
+        self._observed = self.seq
+        return self.seq, self.value
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "seq": self.seq,
+            "published": self.published,
+            "consumed": self.consumed,
+            "dropped": self.dropped,
+            "pending": self._fresh,
+        }
@@ -3,6 +3,7 @@ import time
 from ultralytics import YOLO
 from picamera2 import Picamera2
 import numpy as np
+import alloc_profiler  # ALLOC_PROFILE=1 prints a per-stage copy/allocation report on exit
 
 print("Loading YOLO model...")
 model = YOLO('yolov8n.pt')
@@ -26,25 +27,28 @@ cv2.resizeWindow("YOLOv8", 320, 240)
 print("Starting inference loop. Press 'q' to quit.")
 
 while True:
-    frame = picam2.capture_array()
+    with alloc_profiler.stage("capture"):
+        frame = picam2.capture_array()
     frame_count += 1
 
     if frame_count % 2 == 0:
-        results = model(frame, imgsz=416, conf=0.5)
-        annotated_frame = results[0].plot()
+        with alloc_profiler.stage("infer"):
+            results = model(frame, imgsz=416, conf=0.5)
+        with alloc_profiler.stage("plot"):
+            annotated_frame = results[0].plot()
         last_annotated = annotated_frame
     else:
         if last_annotated is not None:
-            annotated_frame = last_annotated.copy()
+            annotated_frame = alloc_profiler.copy_frame(last_annotated, "reuse")
         else:
-            annotated_frame = frame.copy()
+            annotated_frame = alloc_profiler.copy_frame(frame, "reuse")
 
     curr_time = time.time()
     instant_fps = 1 / (curr_time - prev_time)
     fps_smooth = alpha * fps_smooth + (1 - alpha) * instant_fps
     prev_time = curr_time
 
-    display_frame = annotated_frame.copy()
+    display_frame = alloc_profiler.copy_frame(annotated_frame, "display")
     cv2.putText(display_frame, f"FPS: {fps_smooth:.2f}", (10, 30),
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
@@ -55,4 +59,6 @@ while True:
         break
 
 cv2.destroyAllWindows()
+if alloc_profiler.ENABLED:
+    print(alloc_profiler.format_report())
 print("Resources released. Exiting.")
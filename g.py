@@ -1,17 +1,28 @@
 # To send video from pi to server
 import asyncio
+import os
 import time
 import cv2
 from quart import Quart, request, jsonify
 from quart_cors import cors
-import numpy as np
 
 from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
-from picamera2 import Picamera2
-from av import VideoFrame
+if os.environ.get("FAKE_CAMERA") == "1":  # test pattern, e.g. for loadtest.py
+    from fake_camera import FakePicamera2 as Picamera2
+else:
+    from picamera2 import Picamera2
+from replay_source import replay_from_env
+import alloc_profiler
+import loop_monitor
+from activity import ActivityGate, resync
+import peer_stats
+from snapshot import SnapshotCache
 
 app = Quart(__name__)
 app = cors(app, allow_origin="*")
+alloc_profiler.install(app)  # /debug/alloc, populated when ALLOC_PROFILE=1
+loop_monitor.install(app)  # /debug/loop, populated when LOOP_MONITOR=1
+peer_stats.install(app)  # /stats and /metrics: per-session getStats() numbers
 
 picam2 = Picamera2()
 picam2.configure(
@@ -23,6 +34,16 @@ picam2.configure(
 # Control flag for streaming
 streaming = False
 
+
+def capture_snapshot():
+    # Only used when no viewer is capturing; None -> 503 while the camera is stopped
+    return picam2.capture_array() if streaming else None
+
+
+# GET /snapshot: latest frame as JPEG for pollers, without a WebRTC session
+snapshots = SnapshotCache(capture=capture_snapshot, color="rgb")
+snapshots.install(app)
+
 @app.route("/start_stream", methods=["POST"])
 async def start_stream():
     global streaming
@@ -42,6 +63,7 @@ async def stop_stream():
 class CameraVideoTrack(VideoStreamTrack):
     def __init__(self):
         super().__init__()
+        self.activity = ActivityGate()  # IDLE_FPS while nothing in view moves
 
     async def recv(self):
         global streaming
@@ -50,14 +72,26 @@ class CameraVideoTrack(VideoStreamTrack):
         if not streaming:
             # If not streaming, wait a bit and return black frame or no frame
             await asyncio.sleep(0.1)
-            blank_frame = 255 * np.ones((720, 1280, 3), dtype=np.uint8)
-            video_frame = VideoFrame.from_ndarray(blank_frame, format="rgb24")
+            blank_frame = alloc_profiler.new_frame((720, 1280, 3), "idle", fill=255)
+            video_frame = alloc_profiler.from_ndarray(blank_frame, "idle", format="rgb24")
             video_frame.pts = pts
             video_frame.time_base = time_base
             return video_frame
 
-        frame = picam2.capture_array()
-        video_frame = VideoFrame.from_ndarray(frame, format="rgb24")
+        # Captures block until the next sensor frame, so they run off the event
+        # loop; while idle this loop runs at the camera's rate for every viewer
+        with alloc_profiler.stage("capture"):
+            frame = await asyncio.to_thread(picam2.capture_array)
+        snapshots.update(frame)
+        while not self.activity.admit(frame):
+            # Idle scene: keep checking every frame, but don't encode or send
+            if not streaming:
+                break
+            with alloc_profiler.stage("capture"):
+                frame = await asyncio.to_thread(picam2.capture_array)
+            snapshots.update(frame)
+        pts = resync(self, pts)
+        video_frame = alloc_profiler.from_ndarray(frame, "capture", format="rgb24")
         video_frame.pts = pts
         video_frame.time_base = time_base
         return video_frame
@@ -71,15 +105,22 @@ async def offer():
 
     pc = RTCPeerConnection()
     pcs.add(pc)
+    # REPLAY_FILE swaps the camera for a recorded clip (load testing)
+    track = replay_from_env() or CameraVideoTrack()
+    activity = getattr(track, "activity", None)
+    peer_stats.track(pc, "viewer", counters=activity.counters if activity else None)
 
     @pc.on("connectionstatechange")
     async def on_connectionstatechange():
         print("Connection state is", pc.connectionState)
         if pc.connectionState in ["failed", "closed"]:
+            track.stop()  # ends a replay track's decode thread and closes its file
             await pc.close()
             pcs.discard(pc)
 
-    pc.addTrack(CameraVideoTrack())
+    sender = pc.addTrack(track)
+    if activity:
+        activity.request_keyframe = sender._send_keyframe
 
     await pc.setRemoteDescription(offer)
     answer = await pc.createAnswer()
@@ -93,4 +134,4 @@ if __name__ == "__main__":
 
     config = Config()
     config.bind = ["0.0.0.0:5000"]
-    asyncio.run(hypercorn.asyncio.serve(app, config))
+    loop_monitor.run(hypercorn.asyncio.serve(app, config))  # LOOP_RUNNER=uvloop to try uvloop
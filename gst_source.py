@@ -0,0 +1,228 @@
+"""
+GStreamer capture straight from appsink, without cv2.VideoCapture in between.
+
+One camera pipeline is split with a tee into one branch per consumer, each
+ending in its own appsink with the caps that consumer wants (I420 for the
+encoder, BGR for inference, at whatever size). If the camera can produce the
+requested format, videoconvert/videoscale negotiate to passthrough, so the
+only conversion left is the one a consumer actually needs.
+
+Pulled samples are mapped read-only and exposed as numpy views over the
+Gst.Buffer memory. With gst-python's overrides installed, MapInfo.data is a
+memoryview and the views are zero copy; the mapping is held until the frame
+is released, so release it (or use it as a context manager) promptly.
+
+    source = GstFrameSource(TEST_SOURCE, {"encode": ("I420", 640, 480),
+                                         "infer": ("BGR", 320, 240)})
+    source.start()
+    with source.pull("infer") as frame:
+        results = model(frame.array)
+
+An appsink hands each sample to exactly one puller, so WebRTC viewers don't
+pull themselves: ``source.feed("encode")`` runs one puller per branch that
+converts each sample to an av.VideoFrame once and publishes it to a
+LatestMailbox, and every GstVideoTrack reads from that.
+"""
+import asyncio
+import fractions
+import time
+
+import av
+import gi
+import numpy as np
+from aiortc import VideoStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GstVideo", "1.0")
+from gi.repository import Gst, GstVideo  # noqa: E402
+
+from frame_mailbox import LatestMailbox  # noqa: E402
+
+Gst.init(None)
+
+# Camera used by sendpi_webrtc_gstreamer.py; override for other boards
+PI_CAMERA_SOURCE = "libcamerasrc camera-name=/base/axi/pcie@1000120000/rp1/i2c@80000/imx500@1a"
+# Synthetic source for testing off-device
+TEST_SOURCE = "videotestsrc is-live=true pattern=ball"
+
+VIDEO_TIME_BASE = fractions.Fraction(1, Gst.SECOND)
+
+# Channels per pixel for packed formats; planar formats are handled separately
+PACKED_CHANNELS = {"BGR": 3, "RGB": 3, "BGRx": 4, "BGRA": 4, "RGBx": 4, "RGBA": 4, "GRAY8": 1}
+AV_FORMATS = {"BGR": "bgr24", "RGB": "rgb24", "BGRx": "bgr0", "BGRA": "bgra", "RGBx": "rgb0",
+              "RGBA": "rgba", "GRAY8": "gray", "I420": "yuv420p", "NV12": "nv12"}
+
+
+def _sub_scale(sub, size):
+    # GST_VIDEO_SUB_SCALE: chroma plane size, rounded up
+    return -((-size) >> sub)
+
+
+class GstMappedFrame:
+    """A pulled sample, mapped for reading. Views are only valid until release()."""
+
+    def __init__(self, sample):
+        self.buffer = sample.get_buffer()
+        caps = sample.get_caps()
+        self.info = GstVideo.VideoInfo.new_from_caps(caps)
+        self.format = self.info.finfo.name
+        self.width = self.info.width
+        self.height = self.info.height
+        self.pts = self.buffer.pts if self.buffer.pts != Gst.CLOCK_TIME_NONE else None
+
+        ok, self._map = self.buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            raise RuntimeError("Failed to map Gst.Buffer")
+        self._data = np.frombuffer(self._map.data, dtype=np.uint8)
+        self.planes = [self._plane(i) for i in range(self.info.finfo.n_planes)]
+
+    def _plane(self, index):
+        """Strided view of one plane, honouring GStreamer's row padding."""
+        stride = self.info.stride[index]
+        offset = self.info.offset[index]
+        height = _sub_scale(self.info.finfo.h_sub[index], self.height)
+        width = _sub_scale(self.info.finfo.w_sub[index], self.width)
+        channels = PACKED_CHANNELS.get(self.format)
+        if channels is None:
+            # Planar/semi-planar: bytes per row in this plane
+            channels = self.info.finfo.pixel_stride[index]
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        strides = (stride, channels, 1) if channels > 1 else (stride, 1)
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._data, offset=offset, strides=strides)
+
+    @property
+    def array(self):
+        """The whole picture as one array: the packed image, or the Y plane for planar formats."""
+        return self.planes[0]
+
+    def to_video_frame(self):
+        """
+        Copy into an av.VideoFrame for aiortc. This is the single copy on the
+        encode path: planes go straight into the AVFrame with no conversion.
+        """
+        frame = av.VideoFrame(self.width, self.height, AV_FORMATS[self.format])
+        for plane, src in zip(frame.planes, self.planes):
+            dst = np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size)
+            rows = src.reshape(src.shape[0], -1)
+            dst[: rows.shape[0], : rows.shape[1]] = rows
+        if self.pts is not None:
+            frame.pts = self.pts
+            frame.time_base = VIDEO_TIME_BASE
+        return frame
+
+    def release(self):
+        if self._map is not None:
+            self.planes = []
+            self._data = None
+            self.buffer.unmap(self._map)
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class GstFrameSource:
+    def __init__(self, source, branches, framerate=30):
+        """
+        ``branches`` maps a consumer name to ``(format, width, height)``, e.g.
+        ``{"encode": ("I420", 640, 640), "infer": ("BGR", 320, 320)}``.
+        """
+        self.source = source
+        self.branches = dict(branches)
+        self.framerate = framerate
+        self.pipeline = Gst.parse_launch(self.describe())
+        self.sinks = {name: self.pipeline.get_by_name(name) for name in self.branches}
+        self.feeds = {}
+
+    def describe(self):
+        parts = [f"{self.source} ! video/x-raw,framerate={self.framerate}/1 ! tee name=t"]
+        for name, (fmt, width, height) in self.branches.items():
+            parts.append(
+                f"t. ! queue leaky=downstream max-size-buffers=1 ! videoconvert ! videoscale ! "
+                f"video/x-raw,format={fmt},width={width},height={height},pixel-aspect-ratio=1/1 ! "
+                f"appsink name={name} max-buffers=1 drop=true sync=false emit-signals=false"
+            )
+        return " ".join(parts)
+
+    def start(self):
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            raise RuntimeError(f"Failed to start pipeline: {self.describe()}")
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+    def negotiated_caps(self, name):
+        pad = self.sinks[name].get_static_pad("sink")
+        caps = pad.get_current_caps()
+        return caps.to_string() if caps else None
+
+    def pull(self, name, timeout=1.0):
+        """Blocking pull of the newest sample for ``name``; None on timeout or EOS."""
+        sample = self.sinks[name].emit("try-pull-sample", int(timeout * Gst.SECOND))
+        if sample is None:
+            return None
+        return GstMappedFrame(sample)
+
+    def feed(self, name):
+        """The shared GstBranchFeed for ``name``, created on first use."""
+        if name not in self.feeds:
+            self.feeds[name] = GstBranchFeed(self, name)
+        return self.feeds[name]
+
+
+class GstBranchFeed:
+    """The single puller of one branch; publishes each sample as an av.VideoFrame."""
+
+    def __init__(self, source, branch):
+        self.source = source
+        self.branch = branch
+        self.frames = LatestMailbox(branch)
+        self.started_at = time.monotonic()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def _pull_frame(self):
+        mapped = self.source.pull(self.branch)
+        if mapped is None:
+            return None
+        with mapped:
+            frame = mapped.to_video_frame()
+        if frame.pts is None:
+            frame.pts = int((time.monotonic() - self.started_at) * Gst.SECOND)
+            frame.time_base = VIDEO_TIME_BASE
+        return frame
+
+    async def run(self):
+        sink = self.source.sinks[self.branch]
+        while True:
+            frame = await asyncio.to_thread(self._pull_frame)
+            if frame is not None:
+                self.frames.publish(frame)
+            elif sink.get_property("eos"):
+                self.frames.publish(None)  # tracks end on None
+                return
+
+
+class GstVideoTrack(VideoStreamTrack):
+    """aiortc track fed from one branch of a GstFrameSource (use an I420 branch)."""
+
+    def __init__(self, source, branch="encode"):
+        super().__init__()
+        self.feed = source.feed(branch)
+        self.seq = 0
+
+    async def recv(self):
+        self.feed.start()
+        # Every viewer gets every frame; the frame is shared, so its pipeline
+        # pts is left as is rather than restamped per track
+        self.seq, frame = await self.feed.frames.wait_newer(self.seq)
+        if frame is None:
+            raise MediaStreamError
+        return frame
@@ -0,0 +1,310 @@
+"""
+One upstream camera -> YOLO -> any number of WebRTC viewers.
+
+This is the pipeline yoloingest.py runs for its single Pi, pulled out so an
+inference worker (inference_worker.py) can host several streams with one
+shared model. Each InferenceStream owns its source supervisor, mailboxes and
+YOLO loop; the model itself is per process and loaded once via load_model().
+"""
+import asyncio
+import os
+import threading
+import time
+
+import aiohttp
+import cv2
+import numpy as np
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer, RTCRtpSender
+
+import alloc_profiler
+import peer_stats
+import sampled_log
+from detection_codec import DetectionChannels
+from fanout import EncodedFanout
+from frame_mailbox import LatestMailbox
+from placement import DEFAULT_FRAME_INTERVAL, EdgeLink, ewma
+from preprocess import Preprocessor
+from readiness import warmup_yolo
+from source_supervisor import SourceSupervisor
+
+FRAME_WIDTH, FRAME_HEIGHT = 640, 480
+MODEL_SIZE = 640  # longest YOLO input side; frames are converted + letterboxed straight to it
+FRAME_TIMEOUT = 5.0
+# Boxes always go to viewers on the "detections" data channel; burning them into
+# the pixels as well is optional (DRAW_BOXES=0 keeps annotation off the hot path)
+DRAW_BOXES = os.environ.get("DRAW_BOXES", "1") == "1"
+
+blank_frame = np.zeros((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+cv2.putText(blank_frame, "Waiting for YOLO...", (50, FRAME_HEIGHT // 2),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+
+# ----------------------------
+# ICE config for remote connectivity
+# ----------------------------
+ice_config = RTCConfiguration(
+    iceServers=[
+        RTCIceServer(urls=["stun:stun.l.google.com:19302"]),
+        RTCIceServer(
+            urls=["turn:global.relay.metered.ca:80"],
+            username="openai",
+            credential="openai"
+        )
+    ]
+)
+
+# ----------------------------
+# CUDA check and YOLO model (one per process, shared by all streams)
+# ----------------------------
+torch = None
+model = None
+device = "cpu"
+# The ultralytics predictor is not thread-safe; streams take turns on the model
+model_lock = threading.Lock()
+infer_seconds = None  # EWMA of one predict() call, excluding the wait for model_lock
+
+
+def load_model():
+    global torch, model, device
+    import torch as _torch
+    from ultralytics import YOLO
+
+    cuda_available = _torch.cuda.is_available()
+    device = 'cuda' if cuda_available else 'cpu'
+    print(f"🌟 CUDA Available: {cuda_available}, Using device: {device}")
+
+    yolo = YOLO("yolov8n.pt")
+    yolo.to(device)
+    with _torch.inference_mode():
+        warmup_yolo(yolo, (MODEL_SIZE, MODEL_SIZE, 3), imgsz=MODEL_SIZE, device=device)
+    torch, model = _torch, yolo
+    return yolo
+
+
+def detect(frame, preprocess):
+    """
+    av.VideoFrame -> ((xyxy in original frame coordinates, class ids,
+    confidences), seconds spent in predict() itself).
+    """
+    global infer_seconds
+    with alloc_profiler.stage("preprocess"):
+        model_input, letterbox = preprocess(frame)
+    with model_lock, torch.inference_mode(), alloc_profiler.stage("infer"):
+        t0 = time.monotonic()
+        results = model.predict(model_input, imgsz=letterbox.imgsz, device=device, verbose=False)
+        elapsed = time.monotonic() - t0
+        infer_seconds = ewma(infer_seconds, elapsed)
+    boxes = results[0].boxes
+    xyxy = letterbox.to_original(boxes.xyxy.cpu().numpy())
+    return (xyxy, boxes.cls.cpu().numpy().astype(int), boxes.conf.cpu().numpy()), elapsed
+
+
+def annotate(frame, xyxy, classes, confidences, names):
+    # Full-resolution BGR is only produced here, when someone is watching
+    img = alloc_profiler.to_ndarray(frame, "annotate", format="bgr24")
+    for (x1, y1, x2, y2), cls_id, conf in zip(xyxy.astype(int), classes, confidences):
+        label = f"{names[cls_id] if names else cls_id} {conf:.2f}"
+        cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(img, label, (x1, y1 - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+    return img
+
+
+# ----------------------------
+# Upstream connection
+# ----------------------------
+async def open_source_session(offer_url, name="source", on_connect=None):
+    """``on_connect(pc)`` runs before the offer, e.g. to add data channels."""
+    pc = RTCPeerConnection(configuration=ice_config)
+    track_ready = asyncio.get_running_loop().create_future()
+
+    @pc.on("track")
+    def on_track(track):
+        if track.kind == "video" and not track_ready.done():
+            print(f"✅ [{name}] video track received")
+            track_ready.set_result(track)
+
+    try:
+        print(f"🔌 [{name}] Connecting to {offer_url}...")
+        pc.addTransceiver("video", direction="recvonly")
+        if on_connect is not None:
+            on_connect(pc)
+        offer = await pc.createOffer()
+        await pc.setLocalDescription(offer)
+
+        timeout = aiohttp.ClientTimeout(total=FRAME_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(
+                offer_url,
+                json={"sdp": pc.localDescription.sdp,
+                      "type": pc.localDescription.type},
+            ) as resp:
+                answer = await resp.json()
+
+        await pc.setRemoteDescription(
+            RTCSessionDescription(sdp=answer["sdp"], type=answer["type"])
+        )
+        track = await asyncio.wait_for(track_ready, timeout=FRAME_TIMEOUT)
+        print(f"✅ [{name}] Connected")
+        return pc, track
+    except BaseException:
+        await pc.close()
+        raise
+
+
+# ----------------------------
+# Stream pipeline
+# ----------------------------
+class InferenceStream:
+    def __init__(self, stream_id, offer_url, model_ready=None):
+        self.stream_id = stream_id
+        self.offer_url = offer_url
+        self.model_ready = model_ready  # awaitable factory, e.g. lambda: readiness.wait("model")
+        self.raw_frames = LatestMailbox("raw")  # source -> YOLO loop (undecoded av.VideoFrame)
+        self.processed_frames = LatestMailbox("processed")  # YOLO loop -> fan-out encoder
+        # Each processed frame is encoded once per quality layer and shared by all viewers
+        self.fanout = EncodedFanout(self.processed_frames, placeholder=blank_frame)
+        # Detections for each sent frame, keyed by the pts the frame goes out with
+        self.detection_channels = DetectionChannels()
+        self.fanout.listeners.append(self.send_detections)
+        # Where YOLO runs for this stream, and the Pi's results when it's the Pi
+        # (placement.py decides; the upstream session is the same either way)
+        self.edge = EdgeLink(stream_id)
+        self.preprocess = Preprocessor(MODEL_SIZE)
+        self.processed = 0
+        self.edge_processed = 0
+        self.busy_seconds = 0.0  # time this stream held the model, for load reporting
+        self.frame_interval = None
+        self.last_frame_at = None
+        self.pcs = set()
+        # While the source is reconnecting, viewers keep getting processed_frames.latest
+        # (the last good frame with its detections) re-sent by the fan-out.
+        self.source = SourceSupervisor(stream_id, self.open_session, self.on_frame,
+                                       frame_timeout=FRAME_TIMEOUT)
+        self.tasks = []
+
+    async def open_session(self):
+        pc, track = await open_source_session(self.offer_url, self.stream_id, on_connect=self.edge.attach)
+        peer_stats.track(pc, "source", counters=lambda: {"frames_decoded": self.source.frames},
+                         stream=self.stream_id)
+        return pc, track
+
+    def on_frame(self, frame):
+        now = time.monotonic()
+        if self.last_frame_at is not None:
+            self.frame_interval = ewma(self.frame_interval, now - self.last_frame_at)
+        self.last_frame_at = now
+        # Conversion happens in the worker thread, at model size (see preprocess.py)
+        self.raw_frames.publish(frame)
+        sampled_log.event("frame_received", key=self.stream_id, stream=self.stream_id,
+                          frames=self.source.frames)
+
+    def class_names(self):
+        return model.names if model is not None else self.edge.names
+
+    async def yolo_loop(self):
+        print(f"🎯 [{self.stream_id}] YOLO worker started")
+        while True:
+            frame_to_process = await self.raw_frames.take()
+            # Placed on the Pi: use what it sent; otherwise (or if it went quiet) infer here
+            detections = self.edge.results(frame_to_process.width, frame_to_process.height)
+            if detections is not None:
+                self.edge_processed += 1
+            else:
+                if self.model_ready is not None:
+                    await self.model_ready()
+                # Only predict() counts: waiting for other streams' turns on the
+                # model would overstate this stream's load
+                detections, elapsed = await asyncio.to_thread(detect, frame_to_process, self.preprocess)
+                self.busy_seconds += elapsed
+
+            if self.fanout.has_subscribers():
+                if DRAW_BOXES:
+                    img = await asyncio.to_thread(annotate, frame_to_process, *detections,
+                                                  self.class_names())
+                else:
+                    img = frame_to_process  # encoded straight from the decoded frame
+                self.processed_frames.publish((img, detections))
+            self.processed += 1
+            sampled_log.event("frame_processed", key=self.stream_id, stream=self.stream_id,
+                              processed=self.processed, placement=self.edge.mode,
+                              dropped=self.raw_frames.dropped)
+
+    def send_detections(self, pts, width, height, detections):
+        if detections is None:
+            return
+        self.detection_channels.set_names(self.class_names())
+        self.detection_channels.broadcast(pts, width, height, *detections)
+
+    async def placement_inputs(self):
+        """Measurements placement.py weighs for this stream."""
+        return {**await self.edge.measure(),
+                "frame_interval": self.frame_interval or DEFAULT_FRAME_INTERVAL}
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.source.run()),
+                      asyncio.create_task(self.yolo_loop()),
+                      asyncio.create_task(self.fanout.run())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.gather(*(pc.close() for pc in list(self.pcs)))
+
+    async def answer(self, params):
+        """
+        Answer a viewer's offer with this stream's processed video. An optional
+        "layer" key in the offer body picks the quality layer (see fanout.py).
+        """
+        pc = RTCPeerConnection(configuration=ice_config)
+        self.pcs.add(pc)
+        track = self.fanout.subscribe(pc, params.get("layer"))
+        # track.layer, not a captured layer: viewers move off layers the source can't fill
+        peer_stats.track(pc, "viewer", stream=self.stream_id, counters=lambda: {
+            "layer": track.layer.name,
+            "frames_sent": track.sent,
+            "frames_encoded": track.layer.frames,
+            "encode_ms": round(track.layer.encode_seconds / max(track.layer.frames, 1) * 1000, 2),
+        })
+        self.detection_channels.attach(pc)
+
+        @pc.on("connectionstatechange")
+        async def on_state_change():
+            print(f"🔁 [{self.stream_id}] Connection state:", pc.connectionState)
+            if pc.connectionState in ["failed", "closed"]:
+                track.stop()
+                await pc.close()
+                self.pcs.discard(pc)
+
+        @pc.on("iceconnectionstatechange")
+        async def on_ice_state_change():
+            print("❄️ ICE state:", pc.iceConnectionState)
+
+        # Force VP8 codec (the fan-out sends pre-encoded VP8 packets)
+        for transceiver in pc.getTransceivers():
+            if transceiver.kind == "video":
+                transceiver.setCodecPreferences(
+                    [c for c in RTCRtpSender.getCapabilities("video").codecs
+                     if c.mimeType == "video/VP8"]
+                )
+
+        offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
+        await pc.setRemoteDescription(offer)
+        answer = await pc.createAnswer()
+        await pc.setLocalDescription(answer)
+        return {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
+
+    def stats(self):
+        return {
+            **self.source.stats(),
+            "stream_id": self.stream_id,
+            "offer_url": self.offer_url,
+            "processed": self.processed,
+            "edge_processed": self.edge_processed,
+            **self.edge.stats(),
+            "busy_seconds": round(self.busy_seconds, 3),
+            "viewers": len(self.pcs),
+            "layers": self.fanout.stats(),
+            "detection_messages": self.detection_channels.sent,
+            "mailboxes": [self.raw_frames.stats(), self.processed_frames.stats()],
+        }
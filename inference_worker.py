@@ -0,0 +1,143 @@
+# Inference worker: runs whichever streams coordinator.py assigns to it,
+# all sharing one YOLO model. Several can run per machine (one per core/GPU).
+#
+#   python3 inference_worker.py --port 8101 --coordinator http://coordinator:7000
+import argparse
+import asyncio
+import socket
+import time
+
+from quart import Quart, request, jsonify
+from quart_cors import cors
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+
+from cluster import post_json, get_json
+import inference_stream
+from inference_stream import InferenceStream, load_model
+from placement import PlacementController
+from readiness import Readiness
+import alloc_profiler
+import loop_monitor
+import peer_stats
+
+HEARTBEAT_INTERVAL = 2.0
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+readiness = Readiness("model")
+readiness.install(app)
+alloc_profiler.install(app)  # /debug/alloc, populated when ALLOC_PROFILE=1
+loop_monitor.install(app)  # /debug/loop, populated when LOOP_MONITOR=1
+peer_stats.install(app)  # /stats and /metrics: per-session getStats() numbers
+
+streams = {}  # stream_id -> InferenceStream
+settings = {}  # worker_id, url, coordinator, capacity (filled in from argv)
+# Moves each stream's inference between its Pi and this worker's shared model
+placement = PlacementController(lambda: list(streams.values()), lambda: inference_stream.infer_seconds)
+placement.install(app)  # /placement
+
+
+async def start_stream(stream_id, offer_url):
+    stream = streams.get(stream_id)
+    if stream is not None and stream.offer_url == offer_url:
+        return stream
+    if stream is not None:
+        await stop_stream(stream_id)
+    stream = InferenceStream(stream_id, offer_url, model_ready=lambda: readiness.wait("model"))
+    streams[stream_id] = stream
+    stream.start()
+    print(f"▶️ Started {stream_id} from {offer_url}")
+    return stream
+
+
+async def stop_stream(stream_id):
+    stream = streams.pop(stream_id, None)
+    if stream is not None:
+        await stream.stop()
+        print(f"⏹️ Stopped {stream_id}")
+
+
+@app.route("/streams", methods=["POST"])
+async def add_stream():
+    body = await request.get_json()
+    await start_stream(body["stream_id"], body["offer_url"])
+    return jsonify({"status": "running", "stream_id": body["stream_id"]})
+
+
+@app.route("/streams/<stream_id>", methods=["DELETE"])
+async def remove_stream(stream_id):
+    await stop_stream(stream_id)
+    return jsonify({"status": "stopped"})
+
+
+@app.route("/streams")
+async def list_streams():
+    return jsonify({sid: stream.stats() for sid, stream in streams.items()})
+
+
+@app.route("/streams/<stream_id>/offer", methods=["POST"])
+async def stream_offer(stream_id):
+    params = await request.get_json()
+    stream = streams.get(stream_id)
+    if stream is not None:
+        return jsonify(await stream.answer(params))
+
+    # Not ours: find the owner through the coordinator and forward the offer
+    info = await get_json(f"{settings['coordinator']}/streams/{stream_id}")
+    if not info.get("worker_url") or info["worker"] == settings["worker_id"]:
+        return jsonify({"error": "stream not available"}), 503
+    return jsonify(await post_json(f"{info['worker_url']}/streams/{stream_id}/offer", params))
+
+
+async def heartbeat_loop():
+    last_busy, last_time = 0.0, time.monotonic()
+    while True:
+        # Utilization = fraction of wall time the (shared, serialized) model was busy
+        busy = sum(stream.busy_seconds for stream in streams.values())
+        now = time.monotonic()
+        utilization = max(0.0, busy - last_busy) / max(now - last_time, 1e-6)
+        last_busy, last_time = busy, now
+        try:
+            reply = await post_json(f"{settings['coordinator']}/workers/heartbeat", {
+                "worker_id": settings["worker_id"],
+                "url": settings["url"],
+                "capacity": settings["capacity"],
+                "utilization": round(min(utilization, 1.0), 3),
+                "streams": [{"stream_id": s.stream_id, "offer_url": s.offer_url}
+                            for s in streams.values()],
+            })
+            for stream_id in reply.get("drop", []):
+                await stop_stream(stream_id)
+        except Exception as e:
+            print(f"⚠️ Heartbeat to coordinator failed: {e}")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def main(args):
+    host = args.advertise or socket.gethostname()
+    settings.update(
+        worker_id=args.worker_id or f"{host}:{args.port}",
+        url=f"http://{host}:{args.port}",
+        coordinator=args.coordinator.rstrip("/"),
+        capacity=args.capacity,
+    )
+    asyncio.create_task(readiness.load("model", load_model, retry_delay=10))
+    asyncio.create_task(heartbeat_loop())
+    asyncio.create_task(placement.run())
+
+    config = Config()
+    config.bind = [f"0.0.0.0:{args.port}"]
+    print(f"🚀 Inference worker {settings['worker_id']} starting on 0.0.0.0:{args.port}")
+    await serve(app, config)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--coordinator", default="http://127.0.0.1:7000")
+    parser.add_argument("--advertise", help="hostname/IP other nodes use to reach this worker")
+    parser.add_argument("--worker-id")
+    parser.add_argument("--capacity", type=int, default=1, help="relative share of streams")
+    args = parser.parse_args()
+    loop_monitor.run(main(args))  # LOOP_RUNNER=uvloop to try uvloop
@@ -1,107 +1,131 @@
 # works in react both sterams
 import asyncio
-import cv2
 import io
 import aiohttp
-from aiortc import RTCPeerConnection, VideoStreamTrack, RTCSessionDescription
-from quart import Quart, Response
-from PIL import Image
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from quart import Quart, Response, jsonify
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
 from quart_cors import cors  # CORS support
+from source_supervisor import SourceSupervisor
+from frame_mailbox import LatestMailbox
+import alloc_profiler
+import loop_monitor
+import peer_stats
 
 app = Quart(__name__)
 app = cors(app, allow_origin="*")  # Allow all origins
+alloc_profiler.install(app)  # /debug/alloc, populated when ALLOC_PROFILE=1
+loop_monitor.install(app)  # /debug/loop, populated when LOOP_MONITOR=1
+peer_stats.install(app)  # /stats and /metrics: per-session getStats() numbers
 
-current_frame = None  # latest frame for MJPEG stream
+display_frames = LatestMailbox("display")  # latest frame for MJPEG stream
 
-class VideoTrackReceiver(VideoStreamTrack):
-    def __init__(self, track):
-        super().__init__()
-        self.track = track
+PI_URL = "http://raspberrypi.local:5000"
+PI_FRAME_TIMEOUT = 5.0
 
-    async def recv(self):
-        global current_frame
-        frame = await self.track.recv()
-        img = frame.to_ndarray(format="bgr24")
 
-        # Resize for consistent display
-        target_width = 640
-        scale = target_width / img.shape[1]
-        target_height = int(img.shape[0] * scale)
-        img_resized = cv2.resize(img, (target_width, target_height))
+DISPLAY_WIDTH = 640
+jpeg_cache = {"seq": None, "task": None}  # newest encode, shared by all /video_feed clients
 
-        current_frame = img_resized
-        return frame
 
-async def display_frames(track):
-    receiver = VideoTrackReceiver(track)
-    try:
-        while True:
-            await receiver.recv()
-    except asyncio.CancelledError:
-        pass
+def on_pi_frame(frame):
+    # Keep the decoded av.VideoFrame as-is; it is only converted when a
+    # /video_feed client actually needs a JPEG of it
+    display_frames.publish(frame)
+
+
+def encode_jpeg(frame):
+    # Resize for consistent display: swscale converts to RGB and scales in one pass
+    target_height = int(frame.height * DISPLAY_WIDTH / frame.width) & ~1
+    with alloc_profiler.stage("jpeg"):
+        image = frame.to_image(width=DISPLAY_WIDTH, height=target_height)
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG")
+    return buf.getvalue()
 
-async def run_webrtc():
-    async with aiohttp.ClientSession() as session:
+
+async def open_pi_session():
+    timeout = aiohttp.ClientTimeout(total=PI_FRAME_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
         # Start Pi stream
-        start_resp = await session.post("http://raspberrypi.local:5000/start_stream")
+        start_resp = await session.post(f"{PI_URL}/start_stream")
         if start_resp.status != 200:
-            print("Failed to start stream:", await start_resp.text())
-            return
+            raise RuntimeError(f"Failed to start stream: {await start_resp.text()}")
         print("Stream started.")
 
     pc = RTCPeerConnection()
-    pc.addTransceiver("video", direction="recvonly")
-
-    display_task = None
+    track_ready = asyncio.get_running_loop().create_future()
 
     @pc.on("track")
     def on_track(track):
         print(f"Track received: {track.kind}")
-        if track.kind == "video":
-            nonlocal display_task
-            display_task = asyncio.create_task(display_frames(track))
-
-    offer = await pc.createOffer()
-    await pc.setLocalDescription(offer)
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "http://raspberrypi.local:5000/offer",
-            json={"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
-        ) as resp:
-            if resp.status != 200:
-                print("Offer failed:", await resp.text())
-                return
-            answer_json = await resp.json()
-
-    answer = RTCSessionDescription(sdp=answer_json["sdp"], type=answer_json["type"])
-    await pc.setRemoteDescription(answer)
-    print("WebRTC connected.")
+        if track.kind == "video" and not track_ready.done():
+            track_ready.set_result(track)
 
     try:
-        while True:
-            await asyncio.sleep(1)
-    except asyncio.CancelledError:
-        if display_task:
-            display_task.cancel()
+        pc.addTransceiver("video", direction="recvonly")
+        offer = await pc.createOffer()
+        await pc.setLocalDescription(offer)
+
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(
+                f"{PI_URL}/offer",
+                json={"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
+            ) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"Offer failed: {await resp.text()}")
+                answer_json = await resp.json()
+
+        answer = RTCSessionDescription(sdp=answer_json["sdp"], type=answer_json["type"])
+        await pc.setRemoteDescription(answer)
+        track = await asyncio.wait_for(track_ready, timeout=PI_FRAME_TIMEOUT)
+        print("WebRTC connected.")
+        peer_stats.track(pc, "source", counters=lambda: {"frames_decoded": pi_source.frames})
+        return pc, track
+    except BaseException:
+        await pc.close()
+        raise
+
+
+# display_frames keeps the last good frame while the Pi reconnects
+pi_source = SourceSupervisor("pi", open_pi_session, on_pi_frame,
+                             frame_timeout=PI_FRAME_TIMEOUT)
+
+
+@app.route("/source")
+async def source_status():
+    return jsonify({**pi_source.stats(), "mailboxes": [display_frames.stats()]})
+
+async def latest_jpeg(seq, img):
+    """
+    JPEG of frame ``seq``, encoded once off the event loop however many
+    clients ask for it. If a newer frame is already cached it is served
+    instead (with its seq); an older frame never replaces it.
+    """
+    if jpeg_cache["seq"] is None or seq > jpeg_cache["seq"]:
+        jpeg_cache.update(seq=seq, task=asyncio.ensure_future(asyncio.to_thread(encode_jpeg, img)))
+    seq, task = jpeg_cache["seq"], jpeg_cache["task"]
+    # Shielded: a client disconnecting mustn't cancel the encode others are waiting on
+    return seq, await asyncio.shield(task)
+
 
 # Optional MJPEG stream for React or browser
 @app.route("/video_feed")
 async def video_feed():
     async def generate():
-        global current_frame
+        seq = 0
         try:
             while True:
-                if current_frame is not None:
-                    img_rgb = cv2.cvtColor(current_frame, cv2.COLOR_BGR2RGB)
-                    buf = io.BytesIO()
-                    Image.fromarray(img_rgb).save(buf, format="JPEG")
-                    yield b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + buf.getvalue() + b"\r\n"
-                else:
+                # Only encode when there is a frame this client hasn't seen yet
+                try:
+                    seq, img = await asyncio.wait_for(display_frames.wait_newer(seq), timeout=1.0)
+                except asyncio.TimeoutError:
                     yield b"--frame\r\nContent-Type: text/plain\r\n\r\n.\r\n"
-                await asyncio.sleep(0.05)
+                    continue
+                seq, data = await latest_jpeg(seq, img)
+                yield b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + data + b"\r\n"
+                await asyncio.sleep(0.05)  # cap at ~20 fps per client
         except asyncio.CancelledError:
             pass
 
@@ -112,12 +136,12 @@ async def main():
     config.bind = ["0.0.0.0:8000"]
 
     quart_task = asyncio.create_task(serve(app, config))
-    webrtc_task = asyncio.create_task(run_webrtc())
+    webrtc_task = asyncio.create_task(pi_source.run())
 
     await asyncio.gather(quart_task, webrtc_task)
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        loop_monitor.run(main())  # LOOP_RUNNER=uvloop to try uvloop
     except KeyboardInterrupt:
         print("Exiting...")
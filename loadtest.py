@@ -0,0 +1,330 @@
+"""
+Viewer load test: how many concurrent WebRTC viewers a server holds.
+
+Starts the server under test on localhost with a synthetic camera, then ramps
+headless aiortc clients that negotiate exactly like App.js and
+pythonclienterbrtcfrompi.py (recvonly video transceiver, POST {sdp, type} to
+/offer). At every step it records, for the clients added in that step,
+offer latency (POST -> answer) and time to first frame; for all clients,
+the received frame rate; and the server's CPU and RSS. The result is a
+capacity curve: the last step whose median fps is still within
+--collapse-ratio of the single-client rate.
+
+    python3 loadtest.py --target servecv --steps 1,2,4,8,16,32
+    python3 loadtest.py --target yoloingest --out yolo.json --min-capacity 8
+    python3 loadtest.py --url http://127.0.0.1:5000 --pid 1234   # already running
+
+Targets and their synthetic camera:
+  servecv     REPLAY_FILE=<generated clip>
+  g           FAKE_CAMERA=1 (fake_camera.py), after POST /start_stream
+  webrtc      webrtcwithyoloandflask.py with FAKE_CAMERA=1
+  yoloingest  servecv.py (replayed clip) as the Pi, PI_OFFER_URL pointing at it
+
+The clients decode every frame in this process, so on a small machine they
+compete with the server for CPU; the harness reports its own CPU next to the
+server's so that shows up in the numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import av
+import numpy as np
+from aiortc import RTCPeerConnection, RTCSessionDescription
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE_URL = "http://127.0.0.1:5000"
+
+TARGETS = {
+    # name: (processes as (script, extra env), URL under test, needs /start_stream)
+    "servecv": ([("servecv.py", {"REPLAY_FILE": "{clip}"})], "http://127.0.0.1:5000", False),
+    "g": ([("g.py", {"FAKE_CAMERA": "1"})], "http://127.0.0.1:5000", True),
+    "webrtc": ([("webrtcwithyoloandflask.py", {"FAKE_CAMERA": "1"})], "http://127.0.0.1:5000", False),
+    "yoloingest": ([("servecv.py", {"REPLAY_FILE": "{clip}"}),
+                    ("yoloingest.py", {"PI_OFFER_URL": SOURCE_URL + "/offer"})],
+                   "http://127.0.0.1:8000", False),
+}
+
+
+# ----------------------------
+# Synthetic camera
+# ----------------------------
+def make_synthetic_clip(path, seconds=10, width=640, height=480, fps=30):
+    """A moving gradient with a bouncing block, so the encoder has real work."""
+    container = av.open(path, "w")
+    stream = container.add_stream("mpeg4", rate=fps)
+    stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+    stream.bit_rate = 2_000_000
+    ys, xs = np.mgrid[0:height, 0:width]
+    for i in range(seconds * fps):
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        img[..., 0] = (xs + i * 4) % 256
+        img[..., 1] = (ys + i * 2) % 256
+        img[..., 2] = 96
+        x = int((width - 80) * abs((i % 120) / 60 - 1))
+        y = int((height - 80) * abs((i % 90) / 45 - 1))
+        img[y:y + 80, x:x + 80] = 255
+        for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="bgr24")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+    return path
+
+
+# ----------------------------
+# Process CPU / RSS (psutil if installed, /proc otherwise)
+# ----------------------------
+def process_usage(pid):
+    """(cpu seconds, rss bytes) for ``pid``."""
+    try:
+        import psutil
+    except ImportError:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        return cpu, rss
+    proc = psutil.Process(pid)
+    times = proc.cpu_times()
+    return times.user + times.system, proc.memory_info().rss
+
+
+# ----------------------------
+# Headless viewer
+# ----------------------------
+class Viewer:
+    def __init__(self, url):
+        self.url = url
+        self.pc = None
+        self.started_at = None
+        self.offer_latency = None
+        self.first_frame_at = None
+        self.frames = 0
+        self.error = None
+        self.task = None
+
+    @property
+    def ttff(self):
+        return self.first_frame_at - self.started_at if self.first_frame_at else None
+
+    async def connect(self, session):
+        self.started_at = time.monotonic()
+        self.pc = RTCPeerConnection()
+        self.pc.addTransceiver("video", direction="recvonly")
+
+        @self.pc.on("track")
+        def on_track(track):
+            if track.kind == "video":
+                self.task = asyncio.create_task(self.consume(track))
+
+        try:
+            offer = await self.pc.createOffer()
+            await self.pc.setLocalDescription(offer)
+            t0 = time.monotonic()
+            async with session.post(self.url + "/offer", json={
+                "sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type,
+            }) as resp:
+                answer = await resp.json()
+            self.offer_latency = time.monotonic() - t0
+            await self.pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    async def consume(self, track):
+        try:
+            while True:
+                await track.recv()
+                if self.first_frame_at is None:
+                    self.first_frame_at = time.monotonic()
+                self.frames += 1
+        except Exception as e:
+            self.error = self.error or f"track ended: {type(e).__name__}"
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.pc is not None:
+            await self.pc.close()
+
+
+def pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+# ----------------------------
+# Ramp
+# ----------------------------
+async def run_step(session, viewers, target, url, settle, seconds, server_pid):
+    added = [Viewer(url) for _ in range(target - len(viewers))]
+    await asyncio.gather(*(v.connect(session) for v in added))
+    viewers.extend(added)
+    await asyncio.sleep(settle)
+
+    frames_before = [v.frames for v in viewers]
+    server_before = process_usage(server_pid) if server_pid else None
+    self_before = process_usage(os.getpid())
+    t0 = time.monotonic()
+    await asyncio.sleep(seconds)
+    elapsed = time.monotonic() - t0
+    server_after = process_usage(server_pid) if server_pid else None
+    self_after = process_usage(os.getpid())
+
+    fps = [(v.frames - before) / elapsed for v, before in zip(viewers, frames_before)]
+    offer = [v.offer_latency for v in added if v.offer_latency is not None]
+    ttff = [v.ttff for v in added if v.ttff is not None]
+    return {
+        "clients": len(viewers),
+        "receiving": sum(1 for f in fps if f > 0),
+        "errors": sum(1 for v in viewers if v.error),
+        "offer_ms_p50": ms(pct(offer, 0.5)),
+        "offer_ms_p95": ms(pct(offer, 0.95)),
+        "ttff_ms_p50": ms(pct(ttff, 0.5)),
+        "ttff_ms_p95": ms(pct(ttff, 0.95)),
+        "fps_median": round(statistics.median(fps), 2),
+        "fps_p10": round(pct(fps, 0.1), 2),
+        "fps_min": round(min(fps), 2),
+        "server_cpu_pct": round((server_after[0] - server_before[0]) / elapsed * 100, 1) if server_pid else None,
+        "server_rss_mb": round(server_after[1] / 1e6, 1) if server_pid else None,
+        "harness_cpu_pct": round((self_after[0] - self_before[0]) / elapsed * 100, 1),
+    }
+
+
+def capacity(rows, collapse_ratio):
+    """Largest client count still within collapse_ratio of the 1st step's fps."""
+    if not rows:
+        return 0
+    baseline = rows[0]["fps_median"]
+    best = 0
+    for row in rows:
+        if row["receiving"] < row["clients"] or row["fps_median"] < baseline * collapse_ratio:
+            break
+        best = row["clients"]
+    return best
+
+
+def print_row(row):
+    print(f"{row['clients']:>5} {row['receiving']:>5} {row['offer_ms_p50'] or '-':>8} {row['offer_ms_p95'] or '-':>8} "
+          f"{row['ttff_ms_p50'] or '-':>8} {row['ttff_ms_p95'] or '-':>8} {row['fps_median']:>7} {row['fps_p10']:>7} "
+          f"{row['server_cpu_pct'] if row['server_cpu_pct'] is not None else '-':>7} "
+          f"{row['server_rss_mb'] if row['server_rss_mb'] is not None else '-':>8} {row['harness_cpu_pct']:>7}")
+
+
+def print_curve(rows, cap):
+    peak = max((row["fps_median"] for row in rows), default=0) or 1
+    print(f"\nCapacity curve (median fps per client); capacity = {cap} clients")
+    for row in rows:
+        bar = "█" * int(40 * row["fps_median"] / peak)
+        mark = " ◀ capacity" if row["clients"] == cap else ""
+        print(f"{row['clients']:>5} | {bar:<40} {row['fps_median']:>6}{mark}")
+
+
+async def wait_until_up(url, timeout=180):
+    # /readyz where the server has one (model loaded); any answer otherwise
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=2)) as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + "/readyz") as resp:
+                    if resp.status in (200, 404):
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def spawn(target, clip, procs):
+    scripts = TARGETS[target][0]
+    for i, (script, env) in enumerate(scripts):
+        env = {**os.environ, **{k: v.format(clip=clip) for k, v in env.items()}}
+        procs.append(subprocess.Popen([sys.executable, os.path.join(HERE, script)], env=env, cwd=HERE))
+        if i < len(scripts) - 1:
+            await wait_until_up(SOURCE_URL)  # the source is up before its consumer connects
+
+
+async def main(args):
+    procs = []
+    workdir = tempfile.TemporaryDirectory(prefix="loadtest-")
+    try:
+        if args.url:
+            url, server_pid, start_stream = args.url.rstrip("/"), args.pid, args.start_stream
+        else:
+            clip = make_synthetic_clip(os.path.join(workdir.name, "synthetic.mp4"))
+            await spawn(args.target, clip, procs)
+            url, start_stream = TARGETS[args.target][1], TARGETS[args.target][2]
+            server_pid = procs[-1].pid
+        print(f"⏳ Waiting for {url}...")
+        await wait_until_up(url)
+
+        steps = [int(n) for n in args.steps.split(",")]
+        viewers, rows = [], []
+        timeout = aiohttp.ClientTimeout(total=args.offer_timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            if start_stream:
+                await session.post(url + "/start_stream")
+            print(f"{'N':>5} {'recv':>5} {'offer50':>8} {'offer95':>8} {'ttff50':>8} {'ttff95':>8} "
+                  f"{'fps50':>7} {'fps10':>7} {'cpu%':>7} {'rss MB':>8} {'self%':>7}")
+            for n in steps:
+                row = await run_step(session, viewers, n, url, args.settle, args.step_seconds, server_pid)
+                rows.append(row)
+                print_row(row)
+                if row["fps_median"] < rows[0]["fps_median"] * args.collapse_ratio / 2:
+                    print("🛑 Frame rate collapsed; stopping the ramp")
+                    break
+        await asyncio.gather(*(v.close() for v in viewers))
+
+        cap = capacity(rows, args.collapse_ratio)
+        print_curve(rows, cap)
+        result = {"target": args.target or url, "steps": rows, "capacity": cap,
+                  "collapse_ratio": args.collapse_ratio, "step_seconds": args.step_seconds}
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(result, f, indent=2)
+            print(f"💾 Wrote {args.out}")
+        return cap
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ramp headless WebRTC viewers against a server")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="servecv")
+    parser.add_argument("--url", help="test an already-running server instead of spawning one")
+    parser.add_argument("--pid", type=int, help="server process to sample CPU/RSS from (with --url)")
+    parser.add_argument("--start-stream", action="store_true", help="POST /start_stream first (with --url)")
+    parser.add_argument("--steps", default="1,2,4,8,16,32")
+    parser.add_argument("--step-seconds", type=float, default=10.0)
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds between adding clients and measuring")
+    parser.add_argument("--offer-timeout", type=float, default=30.0)
+    parser.add_argument("--collapse-ratio", type=float, default=0.8)
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--min-capacity", type=int, help="exit 1 if capacity is below this (CI)")
+    args = parser.parse_args()
+
+    cap = asyncio.run(main(args))
+    if args.min_capacity is not None and cap < args.min_capacity:
+        print(f"❌ Capacity {cap} is below the required {args.min_capacity}")
+        sys.exit(1)
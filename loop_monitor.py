@@ -0,0 +1,286 @@
+"""
+Opt-in event-loop stall detector.
+
+Set LOOP_MONITOR=1 to turn it on. A heartbeat task wakes every
+LOOP_MONITOR_INTERVAL seconds and records how late it woke up (the loop lag).
+A watchdog thread watches that heartbeat; once the loop has been stuck for
+more than LOOP_STALL_MS it samples the loop thread's Python stack every few
+milliseconds until the loop runs again. Each stall is charged to the call
+site seen most often in its samples: the innermost frame in this repo, i.e.
+the line that made the blocking call (capture_array(), cap.read(), model(),
+imshow/waitKey, a JPEG encode...). The innermost frame overall is kept too,
+for calls that go through Python library code before blocking.
+
+report() gives lag percentiles and offenders ranked by total stalled time;
+install(app) serves it on /debug/loop. run(coro) is asyncio.run, or a uvloop
+loop when LOOP_RUNNER=uvloop. The report names the loop implementation so
+two runs can be compared, and ``python3 loop_monitor.py --compare`` runs the
+same synthetic load on both and prints the lag side by side.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+ENABLED = os.environ.get("LOOP_MONITOR") == "1"
+RUNNER = os.environ.get("LOOP_RUNNER", "asyncio")  # asyncio | uvloop
+INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.05"))
+STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_MS", "100")) / 1000
+SAMPLE_INTERVAL = 0.005
+MAX_SAMPLES_PER_STALL = 500
+LAG_WINDOW = 2000
+STACK_DEPTH = 16
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _where(entry):
+    return f"{os.path.relpath(entry.filename, HERE)}:{entry.lineno} {entry.name}"
+
+
+def _site(stack):
+    """(innermost repo frame, innermost frame) of a sampled stack."""
+    leaf = _where(stack[-1])
+    for entry in reversed(stack):
+        path = os.path.abspath(entry.filename)
+        if path.startswith(HERE) and path != os.path.abspath(__file__):
+            return _where(entry), leaf
+    return leaf, leaf
+
+
+class LoopMonitor:
+    def __init__(self, threshold=STALL_THRESHOLD, interval=INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.loop = None
+        self.thread_id = None
+        self.beat = None
+        self.started_at = None
+        self.ticks = 0
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.stalled_seconds = 0.0
+        self.offenders = {}  # site -> totals
+        self._samples = []  # stacks sampled during the current stall
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._task = None
+
+    def start(self):
+        """Start watching the running loop (call from inside it)."""
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.started_at = time.time()
+        self._task = self.loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="loop-monitor", daemon=True).start()
+        print(f"🩺 Loop monitor on ({type(self.loop).__name__}, stall > {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.beat = now
+            lag = max(0.0, now - expected)
+            with self._lock:
+                samples, self._samples = self._samples, []
+            self.ticks += 1
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._record_stall(lag, samples)
+
+    def _watchdog(self):
+        while not self._stop.is_set():
+            if time.monotonic() - self.beat - self.interval < self.threshold:
+                time.sleep(min(self.threshold / 2, 0.02))
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame, limit=STACK_DEPTH)
+                del frame
+                with self._lock:
+                    if len(self._samples) < MAX_SAMPLES_PER_STALL:
+                        self._samples.append(stack)
+            time.sleep(SAMPLE_INTERVAL)
+
+    def _record_stall(self, lag, samples):
+        sites = Counter(_site(stack)[0] for stack in samples)
+        site = sites.most_common(1)[0][0] if sites else "(not sampled)"
+        o = self.offenders.setdefault(site, {
+            "site": site, "stalls": 0, "stalled_ms": 0.0, "max_ms": 0.0,
+            "samples": 0, "leaves": Counter(), "stack": [],
+        })
+        o["stalls"] += 1
+        o["stalled_ms"] += lag * 1000
+        o["max_ms"] = max(o["max_ms"], lag * 1000)
+        for stack in samples:
+            here, leaf = _site(stack)
+            if here == site:
+                o["samples"] += 1
+                o["leaves"][leaf] += 1
+                o["stack"] = [_where(entry) for entry in stack]
+        self.stalls += 1
+        self.stalled_seconds += lag
+        print(f"🐢 Event loop blocked {lag * 1000:.0f} ms in {site}")
+
+    def report(self, limit=15):
+        lags = sorted(self.lags)
+
+        def pct(p):
+            return round(lags[min(len(lags) - 1, int(p * len(lags)))] * 1000, 2) if lags else None
+
+        offenders = sorted(self.offenders.values(), key=lambda o: o["stalled_ms"], reverse=True)
+        return {
+            "enabled": self.loop is not None,
+            "loop": f"{type(self.loop).__module__}.{type(self.loop).__name__}" if self.loop else None,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "interval_ms": round(self.interval * 1000, 1),
+            "seconds": round(time.time() - self.started_at, 1) if self.started_at else 0.0,
+            "ticks": self.ticks,
+            "lag_ms": {
+                "mean": round(sum(lags) / len(lags) * 1000, 2) if lags else None,
+                "p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99),
+                "max": round(self.max_lag * 1000, 2),
+            },
+            "stalls": self.stalls,
+            "stalled_seconds": round(self.stalled_seconds, 3),
+            "offenders": [
+                {**o, "stalled_ms": round(o["stalled_ms"], 1), "max_ms": round(o["max_ms"], 1),
+                 "leaves": dict(o["leaves"].most_common(5))}
+                for o in offenders[:limit]
+            ],
+        }
+
+    def format_report(self, limit=10):
+        r = self.report(limit)
+        lag = r["lag_ms"]
+        lines = [
+            f"Loop {r['loop']} over {r['seconds']}s: lag p50 {lag['p50']} ms, p95 {lag['p95']} ms, "
+            f"p99 {lag['p99']} ms, max {lag['max']} ms; {r['stalls']} stalls "
+            f"({r['stalled_seconds']}s) over {r['threshold_ms']} ms"
+        ]
+        for o in r["offenders"]:
+            lines.append(f"  {o['stalled_ms']:9.1f} ms in {o['stalls']:>5} stalls "
+                         f"(max {o['max_ms']:7.1f} ms)  {o['site']}")
+        return "\n".join(lines)
+
+
+monitor = LoopMonitor()
+
+
+# ----------------------------
+# Module-level helpers (no-ops unless LOOP_MONITOR=1)
+# ----------------------------
+def start():
+    if ENABLED:
+        monitor.start()
+
+
+def report(limit=15):
+    return {**monitor.report(limit), "runner": RUNNER}
+
+
+def format_report(limit=10):
+    return monitor.format_report(limit)
+
+
+def install(app):
+    """Serve report() on /debug/loop of a Quart app and start with the server."""
+    from quart import jsonify, request
+
+    @app.before_serving
+    async def start_loop_monitor():
+        start()
+
+    @app.route("/debug/loop")
+    async def debug_loop():
+        return jsonify(report(int(request.args.get("limit", 15))))
+
+    return app
+
+
+def run(main):
+    """asyncio.run(main), on a uvloop loop when LOOP_RUNNER=uvloop."""
+    if RUNNER == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            print("⚠️ LOOP_RUNNER=uvloop but uvloop is not installed; using asyncio")
+        else:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                return runner.run(main)
+    return asyncio.run(main)
+
+
+# ----------------------------
+# asyncio vs uvloop on the same synthetic load
+# ----------------------------
+def _blocking_call(seconds):
+    time.sleep(seconds)
+
+
+async def _bench(seconds, block_every, block_ms):
+    bench_monitor = LoopMonitor(threshold=block_ms / 2000, interval=0.01)
+    bench_monitor.start()
+
+    async def chatter():
+        # Lots of short callbacks, like per-packet RTP handling
+        while True:
+            await asyncio.sleep(0.001)
+
+    async def blocker():
+        while True:
+            await asyncio.sleep(block_every)
+            _blocking_call(block_ms / 1000)
+
+    tasks = [asyncio.create_task(chatter()) for _ in range(200)] + [asyncio.create_task(blocker())]
+    await asyncio.sleep(seconds)
+    for task in tasks:
+        task.cancel()
+    bench_monitor.stop()
+    return bench_monitor.report(3)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare loop lag under asyncio and uvloop")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--block-every", type=float, default=0.5)
+    parser.add_argument("--block-ms", type=float, default=40.0)
+    args = parser.parse_args()
+
+    bench = lambda: _bench(args.seconds, args.block_every, args.block_ms)
+    runners = [("asyncio", lambda: asyncio.run(bench()))]
+    if args.compare:
+        try:
+            import uvloop
+
+            def on_uvloop():
+                with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                    return runner.run(bench())
+
+            runners.append(("uvloop", on_uvloop))
+        except ImportError:
+            print("⚠️ uvloop is not installed; only measuring asyncio")
+
+    print(f"{'loop':<8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'stalls':>7}  top offender")
+    for name, go in runners:
+        r = go()
+        lag = r["lag_ms"]
+        top = r["offenders"][0]["site"] if r["offenders"] else "-"
+        print(f"{name:<8} {lag['p50']:>8} {lag['p95']:>8} {lag['p99']:>8} {lag['max']:>8} {r['stalls']:>7}  {top}")
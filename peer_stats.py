@@ -0,0 +1,216 @@
+"""
+Per-session WebRTC stats, polled from RTCPeerConnection.getStats().
+
+Servers register every peer connection they create with ``track(pc, role)``;
+a background task polls all of them every STATS_INTERVAL seconds and keeps,
+per session: send/receive bitrate, send/receive packet loss, RTT, jitter, and whatever
+frame counters the application passes in (frames encoded and encode time
+from fanout.py's encoder, frames decoded from a receive loop, the idle mode
+of activity.py's adaptive frame rate). aiortc's
+stats have no encoder or jitter-buffer counters of their own, so those come
+from the ``counters`` callable; the interarrival jitter reported in RTCP is
+the closest receive-side delay measure and is served as ``jitter_ms``.
+
+    GET /stats     JSON, one entry per live session plus totals
+    GET /metrics   the same in Prometheus text exposition format
+"""
+import asyncio
+import itertools
+import os
+import time
+
+STATS_INTERVAL = float(os.environ.get("STATS_INTERVAL", "5"))
+VIDEO_CLOCK_RATE = 90000  # RTP jitter is in timestamp units
+
+# (snapshot key, Prometheus name, type, help)
+METRICS = [
+    ("send_kbps", "webrtc_session_send_bitrate_kbps", "gauge", "Send bitrate over the last poll"),
+    ("recv_kbps", "webrtc_session_recv_bitrate_kbps", "gauge", "Receive bitrate over the last poll"),
+    ("send_loss", "webrtc_session_send_packet_loss_ratio", "gauge", "Sent packets the peer reported lost / packets sent, over the last poll"),
+    ("recv_loss", "webrtc_session_recv_packet_loss_ratio", "gauge", "Received packets lost / expected, over the last poll"),
+    ("rtt_ms", "webrtc_session_rtt_ms", "gauge", "Round-trip time from RTCP receiver reports"),
+    ("jitter_ms", "webrtc_session_jitter_ms", "gauge", "RTP interarrival jitter"),
+    ("packets_sent", "webrtc_session_packets_sent_total", "counter", "RTP packets sent"),
+    ("packets_received", "webrtc_session_packets_received_total", "counter", "RTP packets received"),
+    ("packets_lost", "webrtc_session_packets_lost_total", "counter", "RTP packets lost"),
+    ("frames_sent", "webrtc_session_frames_sent_total", "counter", "Video frames handed to the sender"),
+    ("frames_encoded", "webrtc_session_frames_encoded_total", "counter", "Frames encoded by the session's encoder"),
+    ("encode_ms", "webrtc_session_encode_ms", "gauge", "Mean encode time per frame"),
+    ("frames_decoded", "webrtc_session_frames_decoded_total", "counter", "Video frames received and decoded"),
+    ("idle", "webrtc_session_sender_idle", "gauge", "1 while the sender is at its idle frame rate"),
+    ("frames_skipped", "webrtc_session_frames_skipped_total", "counter", "Captured frames held back while the scene was idle"),
+    ("idle_periods", "webrtc_session_idle_periods_total", "counter", "Times the sender dropped to its idle frame rate"),
+]
+
+
+class Session:
+    def __init__(self, session_id, pc, role, labels, counters):
+        self.id = session_id
+        self.pc = pc
+        self.role = role
+        self.labels = labels
+        self.counters = counters
+        self.created_at = time.monotonic()
+        self.polled_at = None
+        self.totals = {}  # raw counters at the last poll, for rates
+        self.values = {}
+
+    async def poll(self):
+        now = time.monotonic()
+        report = await self.pc.getStats()
+        raw = {"bytes_sent": 0, "bytes_received": 0, "packets_sent": 0,
+               "packets_received": 0, "packets_lost": 0, "remote_lost": 0}
+        rtt = jitter = None
+        for stats in report.values():
+            if stats.type == "transport":
+                raw["bytes_sent"] += stats.bytesSent
+                raw["bytes_received"] += stats.bytesReceived
+            elif stats.type == "outbound-rtp":
+                raw["packets_sent"] += stats.packetsSent
+            elif stats.type == "inbound-rtp":
+                raw["packets_received"] += stats.packetsReceived
+                raw["packets_lost"] += stats.packetsLost
+                if stats.jitter is not None:
+                    jitter = max(jitter or 0, stats.jitter)
+            elif stats.type == "remote-inbound-rtp":
+                # The viewer's receiver report on what we sent
+                raw["remote_lost"] += stats.packetsLost
+                # roundTripTime stays None until a receiver report matches one of our sender reports
+                if stats.roundTripTime is not None:
+                    rtt = max(rtt or 0, stats.roundTripTime)
+                if stats.jitter is not None:
+                    jitter = max(jitter or 0, stats.jitter)
+
+        values = {
+            "packets_sent": raw["packets_sent"],
+            "packets_received": raw["packets_received"],
+            "packets_lost": raw["packets_lost"] + raw["remote_lost"],
+            "rtt_ms": round(rtt * 1000, 1) if rtt is not None else None,
+            "jitter_ms": round(jitter / VIDEO_CLOCK_RATE * 1000, 2) if jitter is not None else None,
+        }
+        if self.polled_at is not None:
+            elapsed = max(now - self.polled_at, 1e-6)
+            delta = {k: raw[k] - self.totals.get(k, 0) for k in raw}
+            values["send_kbps"] = round(delta["bytes_sent"] * 8 / elapsed / 1000, 1)
+            values["recv_kbps"] = round(delta["bytes_received"] * 8 / elapsed / 1000, 1)
+            # Per direction: a sendrecv session mixes both otherwise
+            sent, remote_lost = max(0, delta["packets_sent"]), max(0, delta["remote_lost"])
+            values["send_loss"] = round(min(1.0, remote_lost / sent), 4) if sent else 0.0
+            lost = max(0, delta["packets_lost"])
+            expected = max(0, delta["packets_received"]) + lost
+            values["recv_loss"] = round(lost / expected, 4) if expected else 0.0
+        if self.counters is not None:
+            values.update(self.counters())
+        self.totals, self.polled_at, self.values = raw, now, values
+
+    def snapshot(self):
+        return {"session": self.id, "role": self.role, **self.labels,
+                "state": self.pc.connectionState,
+                "age_seconds": round(time.monotonic() - self.created_at, 1),
+                **self.values}
+
+
+class PeerStatsCollector:
+    def __init__(self, interval=STATS_INTERVAL):
+        self.interval = interval
+        self.sessions = {}  # pc -> Session
+        self.closed = 0
+        self.poll_errors = 0
+        self._ids = itertools.count(1)
+        self._task = None
+
+    def track(self, pc, role="viewer", counters=None, **labels):
+        """
+        Poll ``pc`` until it closes. ``counters`` returns app-level numbers
+        for the session (frames_sent, frames_encoded, encode_ms, frames_decoded,
+        idle, frames_skipped, idle_periods).
+        """
+        session = Session(f"{role}-{next(self._ids)}", pc, role, labels, counters)
+        self.sessions[pc] = session
+
+        @pc.on("connectionstatechange")
+        async def on_state_change():
+            if pc.connectionState in ("failed", "closed") and pc in self.sessions:
+                del self.sessions[pc]
+                self.closed += 1
+
+        return session
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for pc, session in list(self.sessions.items()):
+                if pc.connectionState == "closed":
+                    self.sessions.pop(pc, None)
+                    self.closed += 1
+                    continue
+                try:
+                    await session.poll()
+                except Exception:
+                    self.poll_errors += 1
+
+    def snapshot(self):
+        sessions = [s.snapshot() for s in self.sessions.values()]
+        return {
+            "interval_seconds": self.interval,
+            "sessions": sessions,
+            "totals": {
+                "sessions": len(sessions),
+                "closed": self.closed,
+                "poll_errors": self.poll_errors,
+                "send_kbps": round(sum(s.get("send_kbps") or 0 for s in sessions), 1),
+                "recv_kbps": round(sum(s.get("recv_kbps") or 0 for s in sessions), 1),
+            },
+        }
+
+    def prometheus(self):
+        sessions = [(s, s.snapshot()) for s in self.sessions.values()]
+        lines = [
+            "# HELP webrtc_sessions Live peer connections",
+            "# TYPE webrtc_sessions gauge",
+            f"webrtc_sessions {len(sessions)}",
+            "# HELP webrtc_sessions_closed_total Peer connections closed since start",
+            "# TYPE webrtc_sessions_closed_total counter",
+            f"webrtc_sessions_closed_total {self.closed}",
+        ]
+        for key, name, kind, help_text in METRICS:
+            samples = [(session, snap[key]) for session, snap in sessions if snap.get(key) is not None]
+            if not samples:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for session, value in samples:
+                labels = {"session": session.id, "role": session.role, **session.labels}
+                rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{rendered}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def install(self, app):
+        """Serve /stats (JSON) and /metrics (Prometheus) and poll while the app runs."""
+        from quart import Response, jsonify
+
+        @app.before_serving
+        async def start_peer_stats():
+            self.start()
+
+        @app.route("/stats")
+        async def stats():
+            return jsonify(self.snapshot())
+
+        @app.route("/metrics")
+        async def metrics():
+            return Response(self.prometheus(), mimetype="text/plain; version=0.0.4")
+
+        return app
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+collector = PeerStatsCollector()
+track = collector.track
+install = collector.install
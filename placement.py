@@ -0,0 +1,278 @@
+"""
+Decides, per stream, whether YOLO runs on the Pi ("edge") or on this server.
+
+Both placements use the same WebRTC sessions: the server always receives the
+Pi's video (viewers are fed from here), and a "detections" data channel on
+that upstream connection carries the Pi's results plus small JSON control
+messages. Switching a stream is a message to the Pi
+({"type": "placement", "mode": "edge" | "server"}) and a flag here, so
+nothing reconnects. Until fresh Pi detections arrive after a switch to edge
+(or whenever they stop arriving) the server keeps running its own inference,
+so viewers never go without boxes.
+
+Every DECIDE_INTERVAL seconds the controller estimates the age of the
+detections viewers get for each stream under each placement:
+
+    edge    pi_infer + pi_interval / 2 + rtt / 2
+    server  rtt / 2 + loss * rtt + wait(k) + s + cycle(k) / 2
+
+``s`` is one server inference and ``k`` the number of streams inferring on
+the server. They share one serialized model, so a request waits
+wait(k) = (k - 1) * s / 2 on average and each stream gets a fresh result
+every cycle(k) = max(k * s, frame interval). ``loss * rtt`` stands in for
+NACK retransmission delay. The controller picks the split with the lowest
+total over all streams in this process: moving a stream onto the server only
+pays off if what it gains beats what the others lose to the longer queue.
+A new plan is applied only when it beats the current one by HYSTERESIS, and
+a stream keeps its placement for at least MIN_DWELL seconds.
+
+PLACEMENT=edge or PLACEMENT=server pins every stream instead.
+"""
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from detection_codec import CHANNEL_LABEL, decode
+
+EDGE = "edge"
+SERVER = "server"
+MODE = os.environ.get("PLACEMENT", "auto")  # auto | edge | server
+
+DECIDE_INTERVAL = 2.0
+HYSTERESIS = 0.1
+MIN_DWELL = 10.0
+EDGE_STALE = 1.0  # Pi detections older than this don't count
+REPORT_STALE = 10.0  # without a recent edge_stats the Pi can't take the stream
+DEFAULT_SERVER_INFER = 0.03  # until the first server inference is timed
+DEFAULT_FRAME_INTERVAL = 1 / 30
+
+
+def ewma(prev, value, alpha=0.2):
+    return value if prev is None else prev + alpha * (value - prev)
+
+
+# ----------------------------
+# Latency model
+# ----------------------------
+def edge_age(m):
+    return m["edge_infer"] + m["edge_interval"] / 2 + m["rtt"] / 2
+
+
+def server_age(m, k, s):
+    wait = (k - 1) * s / 2
+    cycle = max(k * s, m["frame_interval"])
+    return m["rtt"] / 2 + m["loss"] * m["rtt"] + wait + s + cycle / 2
+
+
+def evaluate(measurements, assignment, s):
+    k = sum(1 for mode in assignment.values() if mode == SERVER)
+    return sum(server_age(m, k, s) if assignment[sid] == SERVER else edge_age(m)
+               for sid, m in measurements.items())
+
+
+def plan(measurements, s):
+    """{stream_id: measurements} -> ({stream_id: mode}, total estimated age)."""
+    server_only = [sid for sid, m in measurements.items() if m["edge_infer"] is None]
+    movable = [sid for sid, m in measurements.items() if m["edge_infer"] is not None]
+    # Offer the server first to the streams that gain most from it
+    movable.sort(key=lambda sid: edge_age(measurements[sid]) - server_age(measurements[sid], 1, s),
+                 reverse=True)
+    best = None
+    for n in range(len(movable) + 1):
+        assignment = {sid: SERVER for sid in server_only + movable[:n]}
+        assignment.update({sid: EDGE for sid in movable[n:]})
+        total = evaluate(measurements, assignment, s)
+        if best is None or total < best[1]:
+            best = (assignment, total)
+    return best
+
+
+# ----------------------------
+# Server end of a Pi's upstream channel
+# ----------------------------
+class EdgeLink:
+    """
+    Control and results channel to one Pi. ``attach`` is passed to
+    open_source_session so the channel is part of every (re)connect.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.mode = SERVER
+        self.changed_at = time.monotonic()
+        self.pc = None
+        self.channel = None
+        self.detections = None  # (width, height, boxes) as last sent by the Pi
+        self.detections_at = 0.0
+        self.names = None
+        self.report = None  # the Pi's latest edge_stats
+        self.report_at = 0.0
+        self.rtt = None
+        self.loss = 0.0
+        self._rtp = (0, 0)  # (packetsLost, packetsReceived) at the last measure()
+
+    def attach(self, pc):
+        channel = pc.createDataChannel(CHANNEL_LABEL, ordered=False, maxRetransmits=0)
+        self.pc, self.channel, self._rtp = pc, channel, (0, 0)
+
+        @channel.on("open")
+        def on_open():
+            self.announce()
+
+        @channel.on("message")
+        def on_message(message):
+            self.on_message(message)
+
+    def on_message(self, message):
+        now = time.monotonic()
+        if isinstance(message, bytes):
+            _pts, width, height, boxes = decode(message)
+            self.detections, self.detections_at = (width, height, boxes), now
+            return
+        msg = json.loads(message)
+        if msg.get("type") == "classes":
+            self.names = msg["names"]
+        elif msg.get("type") == "edge_stats":
+            self.report, self.report_at = msg, now
+        elif msg.get("type") == "pong":
+            self.rtt = ewma(self.rtt, now - msg["t"])
+
+    def send(self, msg):
+        if self.channel is not None and self.channel.readyState == "open":
+            self.channel.send(json.dumps(msg))
+
+    def announce(self):
+        # Sent every decision step, so a lost message only delays a switch
+        self.send({"type": "placement", "mode": self.mode})
+        self.send({"type": "ping", "t": time.monotonic()})
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            print(f"🔀 [{self.name}] inference placement {self.mode} -> {mode}")
+            self.mode = mode
+            self.changed_at = time.monotonic()
+        self.announce()
+
+    def results(self, width, height):
+        """The Pi's latest detections scaled to a width x height frame, or None."""
+        if self.mode != EDGE or self.detections is None:
+            return None
+        if time.monotonic() - self.detections_at > EDGE_STALE:
+            return None
+        src_w, src_h, boxes = self.detections
+        if not boxes:
+            return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32)
+        arr = np.array(boxes, dtype=np.float32)
+        xyxy = arr[:, 2:6] * np.array([width / src_w, height / src_h] * 2, dtype=np.float32)
+        return xyxy, arr[:, 0].astype(int), arr[:, 1]
+
+    async def measure(self):
+        self.announce()
+        if self.pc is not None and self.pc.connectionState == "connected":
+            lost = received = 0
+            for stats in (await self.pc.getStats()).values():
+                if stats.type == "inbound-rtp":
+                    lost += stats.packetsLost
+                    received += stats.packetsReceived
+            d_lost, d_received = lost - self._rtp[0], received - self._rtp[1]
+            if d_lost + d_received > 0:
+                self.loss = ewma(self.loss, max(0, d_lost) / (max(0, d_lost) + d_received))
+            self._rtp = (lost, received)
+
+        fresh = self.report is not None and time.monotonic() - self.report_at < REPORT_STALE
+        return {
+            "rtt": self.rtt or 0.0,
+            "loss": self.loss,
+            "edge_infer": self.report["infer_ms"] / 1000 if fresh else None,
+            "edge_interval": self.report["interval_ms"] / 1000 if fresh else None,
+        }
+
+    def stats(self):
+        return {
+            "placement": self.mode,
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            "loss": round(self.loss, 4),
+            "edge_report": self.report,
+            "edge_detections_age": round(time.monotonic() - self.detections_at, 3)
+            if self.detections is not None else None,
+        }
+
+
+# ----------------------------
+# Controller
+# ----------------------------
+class PlacementController:
+    def __init__(self, streams, server_infer, mode=MODE):
+        """
+        ``streams`` returns the live InferenceStreams; ``server_infer`` returns
+        the current time for one server inference in seconds (or None).
+        """
+        self.streams = streams
+        self.server_infer = server_infer
+        self.mode = mode
+        self.decisions = 0
+        self.switches = 0
+        self.estimates = {}
+
+    async def run(self):
+        print(f"🧭 Inference placement: {self.mode}")
+        while True:
+            await asyncio.sleep(DECIDE_INTERVAL)
+            try:
+                await self.step()
+            except Exception as e:
+                print(f"⚠️ Placement step failed: {e}")
+
+    async def step(self):
+        streams = {stream.stream_id: stream for stream in self.streams()}
+        measurements = {sid: await stream.placement_inputs() for sid, stream in streams.items()}
+        if self.mode != "auto":
+            for stream in streams.values():
+                stream.edge.set_mode(self.mode)
+            return
+
+        s = self.server_infer() or DEFAULT_SERVER_INFER
+        target, best = plan(measurements, s)
+        current = {sid: stream.edge.mode for sid, stream in streams.items()}
+        # A Pi that stopped reporting can't keep a stream
+        for sid, m in measurements.items():
+            if m["edge_infer"] is None and current[sid] == EDGE:
+                streams[sid].edge.set_mode(SERVER)
+                current[sid] = SERVER
+                self.switches += 1
+        now_total = evaluate(measurements, current, s)
+        self.decisions += 1
+
+        if best < now_total * (1 - HYSTERESIS):
+            now = time.monotonic()
+            for sid, mode in target.items():
+                edge = streams[sid].edge
+                if mode != edge.mode and now - edge.changed_at >= MIN_DWELL:
+                    edge.set_mode(mode)
+                    self.switches += 1
+
+        self.estimates = {
+            "server_infer_ms": round(s * 1000, 1),
+            "current_total_ms": round(now_total * 1000, 1),
+            "best_total_ms": round(best * 1000, 1),
+            "best": target,
+            "streams": {sid: {k: round(v, 4) if isinstance(v, float) else v for k, v in m.items()}
+                        for sid, m in measurements.items()},
+        }
+
+    def report(self):
+        return {"mode": self.mode, "decisions": self.decisions, "switches": self.switches,
+                **self.estimates}
+
+    def install(self, app):
+        """Serve report() on /placement of a Quart app."""
+        from quart import jsonify
+
+        @app.route("/placement")
+        async def placement():
+            return jsonify(self.report())
+
+        return app
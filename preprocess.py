@@ -0,0 +1,86 @@
+"""
+Receive-side preprocessing: av.VideoFrame -> model input in one pass.
+
+Instead of frame.to_ndarray("bgr24") at full resolution followed by a resize
+(and then YOLO letterboxing it again internally), swscale converts and scales
+in a single call straight to the size the model wants. The result is copied
+into a reusable letterbox buffer padded only up to the next multiple of
+STRIDE, like ultralytics' own rectangular letterbox (a 640x480 source runs
+at 640x480, not 640x640), and model.predict is given that shape as
+``imgsz`` so its own letterbox is a no-op.
+
+The returned Letterbox keeps the scale and padding so boxes can be mapped
+back to the original frame's coordinates.
+"""
+import math
+
+import numpy as np
+from av.video.reformatter import Interpolation, VideoReformatter
+
+PAD_VALUE = 114  # same grey ultralytics pads with
+STRIDE = 32  # YOLO input sides must be multiples of this
+
+
+class Letterbox:
+    def __init__(self, src_width, src_height, size):
+        self.src_width = src_width
+        self.src_height = src_height
+        self.size = size
+        self.scale = min(size / src_width, size / src_height)
+        # Even dimensions keep swscale's chroma handling exact
+        self.width = max(2, int(round(src_width * self.scale)) & ~1)
+        self.height = max(2, int(round(src_height * self.scale)) & ~1)
+        self.out_width = math.ceil(self.width / STRIDE) * STRIDE
+        self.out_height = math.ceil(self.height / STRIDE) * STRIDE
+        self.pad_x = (self.out_width - self.width) // 2
+        self.pad_y = (self.out_height - self.height) // 2
+
+    @property
+    def imgsz(self):
+        """The padded input shape, as (height, width) for model.predict(imgsz=...)."""
+        return (self.out_height, self.out_width)
+
+    def to_original(self, boxes):
+        """Map xyxy boxes (N x 4, model input coordinates) back to the source frame."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4).copy()
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - self.pad_x) / self.scale
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - self.pad_y) / self.scale
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, self.src_width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, self.src_height)
+        return boxes
+
+
+class Preprocessor:
+    """
+    Converts frames to letterboxed BGR model input. Output arrays come from a
+    small ring of preallocated buffers, so a result stays valid until
+    ``ring`` further calls; consumers that need it longer must copy.
+
+    Blocking (swscale runs in C); call it via asyncio.to_thread.
+    """
+
+    def __init__(self, size=640, ring=3, interpolation=Interpolation.BILINEAR):
+        self.size = size
+        self.interpolation = interpolation
+        self.reformatter = VideoReformatter()  # keeps the SwsContext between frames
+        self.ring = ring
+        self.buffers = []  # sized once the source resolution is known
+        self.index = 0
+        self.letterbox = None
+
+    def __call__(self, frame):
+        lb = self.letterbox
+        if lb is None or (lb.src_width, lb.src_height) != (frame.width, frame.height):
+            lb = self.letterbox = Letterbox(frame.width, frame.height, self.size)
+            self.buffers = [np.full((lb.out_height, lb.out_width, 3), PAD_VALUE, dtype=np.uint8)
+                            for _ in range(self.ring)]
+
+        scaled = self.reformatter.reformat(
+            frame, width=lb.width, height=lb.height, format="bgr24",
+            interpolation=self.interpolation,
+        ).to_ndarray()
+
+        out = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        out[lb.pad_y:lb.pad_y + lb.height, lb.pad_x:lb.pad_x + lb.width] = scaled
+        return out, lb
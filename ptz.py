@@ -0,0 +1,188 @@
+"""
+Digital pan/tilt/zoom for the Pi camera track.
+
+Rects are (x, y, w, h) normalized to the camera's field of view, so one
+controller drives either kind of crop: the sensor's ScalerCrop, where the ISP
+scales the region to the output size and zooming adds real detail, or a
+software crop of the main-stream array resized back to the negotiated
+resolution.
+
+CropController picks a target and eases the current crop towards it:
+
+    off     the whole field of view
+    auto    the union of detection boxes seen in the last HOLD seconds,
+            padded by MARGIN and widened to the output aspect ratio; back to
+            the whole view once nothing has been detected for HOLD seconds
+    manual  a region the viewer asked for
+"""
+import math
+from collections import deque
+
+import cv2
+import numpy as np
+
+FULL = (0.0, 0.0, 1.0, 1.0)
+MODES = ("off", "auto", "manual")
+MARGIN = 0.25  # padding around the detections, as a fraction of their size
+HOLD = 2.0
+MAX_ZOOM = 4.0
+SMOOTHING = 0.4  # seconds for the crop to cover ~63% of the way to its target
+DEADBAND = 0.03  # target moves smaller than this (fraction of the crop) are ignored
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def largest(ratio):
+    """Largest centred rect with normalized w / h == ratio."""
+    w, h = (1.0, 1.0 / ratio) if ratio >= 1 else (ratio, 1.0)
+    return ((1 - w) / 2, (1 - h) / 2, w, h)
+
+
+def fit(rect, ratio):
+    """Grow ``rect`` to w / h == ratio, at most MAX_ZOOM in, kept inside the view."""
+    x, y, w, h = rect
+    full = largest(ratio)
+    cx, cy = x + w / 2, y + h / 2
+    w = max(w, h * ratio, full[2] / MAX_ZOOM)
+    w = min(w, full[2])
+    h = w / ratio
+    return (_clamp(cx - w / 2, 0.0, 1.0 - w), _clamp(cy - h / 2, 0.0, 1.0 - h), w, h)
+
+
+def parse_region(region):
+    """A viewer-supplied (x, y, w, h) as floats, or None unless it is 4 finite numbers with w, h > 0."""
+    if not isinstance(region, (list, tuple)) or len(region) != 4:
+        return None
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in region):
+        return None
+    x, y, w, h = (float(v) for v in region)
+    if w <= 0 or h <= 0:
+        return None
+    return (x, y, w, h)
+
+
+def union(xyxy):
+    x1, y1 = float(np.min(xyxy[:, 0])), float(np.min(xyxy[:, 1]))
+    x2, y2 = float(np.max(xyxy[:, 2])), float(np.max(xyxy[:, 3]))
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+# ----------------------------
+# Coordinate mapping
+# ----------------------------
+def to_fov(xyxy, view):
+    """Boxes normalized to a frame showing ``view`` -> normalized to the field of view."""
+    x, y, w, h = view
+    return xyxy * np.array([w, h, w, h], dtype=np.float32) + np.array([x, y, x, y], dtype=np.float32)
+
+
+def to_view(xyxy, view, width, height):
+    """Field-of-view boxes -> pixels of a width x height frame showing ``view``.
+
+    Returns (boxes, mask of the input boxes that are still visible)."""
+    x, y, w, h = view
+    out = (xyxy - np.array([x, y, x, y], dtype=np.float32)) / np.array([w, h, w, h], dtype=np.float32)
+    out = np.clip(out, 0.0, 1.0) * np.array([width, height, width, height], dtype=np.float32)
+    visible = (out[:, 2] > out[:, 0]) & (out[:, 3] > out[:, 1])
+    return out[visible], visible
+
+
+def relative(rect, view):
+    """``rect`` as a part of a frame showing ``view``, clamped to that frame."""
+    x = _clamp((rect[0] - view[0]) / view[2], 0.0, 1.0)
+    y = _clamp((rect[1] - view[1]) / view[3], 0.0, 1.0)
+    w = _clamp(rect[2] / view[2], 1e-3, 1.0 - x)
+    h = _clamp(rect[3] / view[3], 1e-3, 1.0 - y)
+    return (x, y, w, h)
+
+
+def absolute(rect, view):
+    """Inverse of relative()."""
+    return (view[0] + rect[0] * view[2], view[1] + rect[1] * view[3], rect[2] * view[2], rect[3] * view[3])
+
+
+def from_sensor(crop, fov):
+    """ScalerCrop (x, y, w, h in sensor pixels) -> normalized rect in ``fov``."""
+    fx, fy, fw, fh = fov
+    return ((crop[0] - fx) / fw, (crop[1] - fy) / fh, crop[2] / fw, crop[3] / fh)
+
+
+def to_sensor(rect, fov):
+    fx, fy, fw, fh = fov
+    x, y, w, h = rect
+    return (int(fx + x * fw), int(fy + y * fh), int(w * fw), int(h * fh))
+
+
+def software_crop(frame, rect, width, height):
+    """Cut ``rect`` out of ``frame`` and scale it to width x height."""
+    rows, cols = frame.shape[:2]
+    x0, y0 = int(rect[0] * cols), int(rect[1] * rows)
+    x1, y1 = max(x0 + 2, int((rect[0] + rect[2]) * cols)), max(y0 + 2, int((rect[1] + rect[3]) * rows))
+    return cv2.resize(frame[y0:y1, x0:x1], (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+# ----------------------------
+# Controller
+# ----------------------------
+class CropController:
+    def __init__(self, aspect, fov_aspect, mode="off"):
+        """``aspect`` is the output width / height; ``fov_aspect`` the field of view's."""
+        self.ratio = aspect / fov_aspect  # output aspect in normalized units
+        self.full = largest(self.ratio)
+        self.mode = mode
+        self.region = None
+        self.current = self.full
+        self.target = self.full
+        self.recent = deque()  # (time, union of that frame's boxes)
+        self.updated_at = None
+
+    def set_mode(self, mode, region=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown PTZ mode {mode!r}")
+        self.mode = mode
+        if region is not None:
+            parsed = parse_region(region)
+            if parsed is None:
+                raise ValueError(f"bad PTZ region {region!r}")
+            x, y, w, h = parsed
+            self.region = (_clamp(x, 0, 1), _clamp(y, 0, 1), _clamp(w, 1e-3, 1), _clamp(h, 1e-3, 1))
+
+    def observe(self, xyxy, now):
+        """Detections for one frame, normalized to the field of view."""
+        if len(xyxy):
+            self.recent.append((now, union(xyxy)))
+
+    def _target(self, now):
+        while self.recent and now - self.recent[0][0] > HOLD:
+            self.recent.popleft()
+        if self.mode == "manual" and self.region is not None:
+            return fit(self.region, self.ratio)
+        if self.mode == "auto" and self.recent:
+            x1 = min(r[0] for _, r in self.recent)
+            y1 = min(r[1] for _, r in self.recent)
+            x2 = max(r[0] + r[2] for _, r in self.recent)
+            y2 = max(r[1] + r[3] for _, r in self.recent)
+            pad_x, pad_y = (x2 - x1) * MARGIN / 2, (y2 - y1) * MARGIN / 2
+            return fit((x1 - pad_x, y1 - pad_y, x2 - x1 + 2 * pad_x, y2 - y1 + 2 * pad_y), self.ratio)
+        return self.full
+
+    def step(self, now):
+        """Advance the crop towards its target; returns the crop for this frame."""
+        target = self._target(now)
+        if max(abs(a - b) for a, b in zip(target, self.target)) > DEADBAND * self.target[2]:
+            self.target = target
+        dt = 0.0 if self.updated_at is None else now - self.updated_at
+        self.updated_at = now
+        alpha = 1.0 - math.exp(-dt / SMOOTHING)
+        self.current = tuple(c + alpha * (t - c) for c, t in zip(self.current, self.target))
+        return self.current
+
+    @property
+    def zoom(self):
+        return self.full[2] / self.current[2]
+
+    def is_full(self, rect=None):
+        rect = rect or self.current
+        return all(abs(a - b) < 1e-3 for a, b in zip(rect, self.full))
@@ -0,0 +1,100 @@
+"""
+Startup readiness tracking for the streaming servers.
+
+Heavy things (torch, YOLO weights, cameras) are loaded in the background so
+the HTTP server can bind straight away. Each piece registers as a component
+and moves through pending -> loading -> ready (or failed); /healthz reports
+that the process is alive, /readyz returns 503 until every component is ready.
+"""
+import asyncio
+import time
+import traceback
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class Readiness:
+    def __init__(self, *components):
+        self.started_at = time.time()
+        self.components = {}
+        self._events = {}
+        for name in components:
+            self.register(name)
+
+    def register(self, name):
+        self.components.setdefault(name, {"state": PENDING, "detail": None, "seconds": None})
+        self._events.setdefault(name, asyncio.Event())
+
+    def set_state(self, name, state, detail=None, seconds=None):
+        self.register(name)
+        self.components[name] = {"state": state, "detail": detail, "seconds": seconds}
+        if state == READY:
+            self._events[name].set()
+        else:
+            self._events[name].clear()
+
+    def is_ready(self, name=None):
+        if name is not None:
+            return self.components.get(name, {}).get("state") == READY
+        return all(c["state"] == READY for c in self.components.values())
+
+    async def wait(self, name):
+        self.register(name)
+        await self._events[name].wait()
+
+    async def load(self, name, fn, *args, retry_delay=None):
+        """
+        Run the blocking loader ``fn(*args)`` in a worker thread and track it
+        as component ``name``. Returns the loader's result, or None on failure.
+        With ``retry_delay`` set, failed loads are retried until they succeed.
+        """
+        while True:
+            self.set_state(name, LOADING)
+            t0 = time.time()
+            try:
+                result = await asyncio.to_thread(fn, *args)
+            except Exception as e:
+                traceback.print_exc()
+                self.set_state(name, FAILED, detail=str(e), seconds=round(time.time() - t0, 3))
+                print(f"❌ {name} failed to load: {e}")
+                if retry_delay is None:
+                    return None
+                await asyncio.sleep(retry_delay)
+                continue
+            self.set_state(name, READY, seconds=round(time.time() - t0, 3))
+            print(f"✅ {name} ready in {time.time() - t0:.2f}s")
+            return result
+
+    def snapshot(self):
+        return {
+            "ready": self.is_ready(),
+            "uptime": round(time.time() - self.started_at, 3),
+            "components": self.components,
+        }
+
+    def install(self, app):
+        """Add /healthz and /readyz routes to a Quart app."""
+        from quart import jsonify
+
+        @app.route("/healthz")
+        async def healthz():
+            return jsonify({"status": "ok", **self.snapshot()})
+
+        @app.route("/readyz")
+        async def readyz():
+            snap = self.snapshot()
+            return jsonify(snap), (200 if snap["ready"] else 503)
+
+        return app
+
+
+def warmup_yolo(model, shape=(480, 640, 3), runs=1, **predict_kwargs):
+    """Push a dummy frame through the model so the first real frame doesn't pay for it."""
+    import numpy as np
+
+    dummy = np.zeros(shape, dtype=np.uint8)
+    for _ in range(runs):
+        model.predict(dummy, verbose=False, **predict_kwargs)
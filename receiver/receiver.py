@@ -1,72 +1,241 @@
 import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
-import numpy as np
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
 from aiortc.contrib.signaling import TcpSocketSignaling
+from aiortc.mediastreams import MediaStreamError
 from av import VideoFrame
 from datetime import datetime, timedelta
-from ultralytics import YOLO
-import torch
-print(torch.cuda.is_available())
-print(torch.cuda.get_device_name(0) if torch.cuda.is_available() else "No GPU")
 
-model = YOLO('yolov8n.pt')
+import readiness  # mounted from the repo root by docker-compose.yml
+from readiness import warmup_yolo
 
-frame_count = 0
-last_annotated = None
-fps_smooth = 0.0
+try:
+    import loop_monitor  # mounted from the repo root by docker-compose.yml; LOOP_MONITOR=1 enables it
+except ImportError:
+    loop_monitor = None
+
+HEALTH_PORT = 8080
+
+# YOLO is loaded in the background (see load_model) so signaling comes up
+# straight away after a container restart.
+model = None
+ready = readiness.Readiness("model")
+
+
+def load_model():
+    from ultralytics import YOLO
+    import torch
+    print(torch.cuda.is_available())
+    print(torch.cuda.get_device_name(0) if torch.cuda.is_available() else "No GPU")
+
+    yolo = YOLO('yolov8n.pt')
+    warmup_yolo(yolo, imgsz=INFER_IMGSZ, conf=INFER_CONF)
+    return yolo
+
+
+async def load_model_in_background():
+    global model
+    model = await ready.load("model", load_model, retry_delay=10)
+
+
+async def handle_health(reader, writer):
+    # Minimal HTTP responder for /healthz and /readyz (no web framework in this image)
+    try:
+        request_line = (await reader.readline()).decode(errors="replace")
+        path = request_line.split(" ")[1] if " " in request_line else "/"
+        body = ready.snapshot()
+        status = "200 OK"
+        if path.startswith("/readyz") and not body["ready"]:
+            status = "503 Service Unavailable"
+        elif path.startswith("/debug/loop") and loop_monitor is not None:
+            body = loop_monitor.report()
+        elif not path.startswith(("/healthz", "/readyz")):
+            status, body = "404 Not Found", {"error": "not found"}
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+# ----------------------------
+# Staged pipeline: receive -> convert -> infer -> annotate -> sink
+#
+# Stages are separate tasks joined by small drop-oldest queues, so a slow
+# stage (inference, the display) loses stale frames instead of stalling
+# track.recv() and the RTP jitter buffer behind it. Inference runs on its own
+# thread and the annotate stage draws the most recent detections on every
+# frame, so displayed video keeps the sender's frame rate.
+# ----------------------------
+STATS_INTERVAL = 5.0
+INFER_IMGSZ = 416
+INFER_CONF = 0.5
+
+
+class DropOldestQueue:
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy = 0.0
+        self._last_count = 0
+        self._last_busy = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.busy += seconds
+
+    def report(self, elapsed):
+        frames = self.count - self._last_count
+        busy = self.busy - self._last_busy
+        self._last_count, self._last_busy = self.count, self.busy
+        avg_ms = 1000 * busy / frames if frames else 0.0
+        return f"{self.name} {frames / elapsed:5.1f} fps {avg_ms:6.1f} ms"
+
+
+def detect(img):
+    results = model(img, imgsz=INFER_IMGSZ, conf=INFER_CONF, verbose=False)
+    boxes = results[0].boxes
+    return (boxes.xyxy.cpu().numpy().astype(int), boxes.cls.cpu().numpy().astype(int),
+            boxes.conf.cpu().numpy(), results[0].names)
+
+
+def detect_frame(frame):
+    return detect(frame.to_ndarray(format="bgr24"))
+
+
+def annotate(img, detections):
+    if detections is not None:
+        xyxy, classes, confidences, names = detections
+        for (x1, y1, x2, y2), cls_id, conf in zip(xyxy, classes, confidences):
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(img, f"{names[cls_id]} {conf:.2f}", (x1, y1 - 5),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1)
+
+    # Add timestamp to the frame
+    current_time = datetime.now()
+    new_time = current_time - timedelta( seconds=55)
+    timestamp = new_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    cv2.putText(img, timestamp, (10, img.shape[0] - 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+    return img
+
+
+def show(img):
+    cv2.imshow("Frame", img)
+    # Exit on 'q' key press
+    return cv2.waitKey(1) & 0xFF == ord('q')
 
 
 class VideoReceiver:
     def __init__(self):
         self.track = None
+        self.stopped = asyncio.Event()
+        self.detections = None
 
-    async def handle_track(self, track):
-        print("Inside handle track")
-        self.track = track
-        frame_count = 0
-        while True:
+        self.to_convert = DropOldestQueue("convert", 2)
+        self.to_infer = DropOldestQueue("infer", 1)
+        self.to_annotate = DropOldestQueue("annotate", 2)
+        self.to_sink = DropOldestQueue("sink", 2)
+        self.queues = [self.to_convert, self.to_infer, self.to_annotate, self.to_sink]
+        self.stats = {name: StageStats(name) for name in ["receive", "convert", "infer", "annotate", "sink"]}
+
+        # One thread each: the model and HighGUI both want a single caller
+        self.infer_executor = ThreadPoolExecutor(1, thread_name_prefix="infer")
+        self.sink_executor = ThreadPoolExecutor(1, thread_name_prefix="sink")
+
+    async def _timed(self, stage, executor, fn, *args):
+        t0 = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        self.stats[stage].record(time.perf_counter() - t0)
+        return result
+
+    async def receive_stage(self, track):
+        while not self.stopped.is_set():
             try:
-                print("Waiting for frame...")
                 frame = await asyncio.wait_for(track.recv(), timeout=5.0)
-                frame_count += 1
-                print(f"Received frame {frame_count}")
-                
-                if isinstance(frame, VideoFrame):
-                    print(f"Frame type: VideoFrame, pts: {frame.pts}, time_base: {frame.time_base}")
-                    frame = frame.to_ndarray(format="bgr24")
-
-                    if frame_count % 3 == 0:
-                        results = model(frame, imgsz=416, conf=0.5)
-                        annotated_frame = results[0].plot()
-                        last_annotated = annotated_frame
-
-                elif isinstance(frame, np.ndarray):
-                    print(f"Frame type: numpy array")
-                else:
-                    print(f"Unexpected frame type: {type(frame)}")
-                    continue
-              
-                 # Add timestamp to the frame
-                current_time = datetime.now()
-                new_time = current_time - timedelta( seconds=55)
-                timestamp = new_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-                cv2.putText(frame, timestamp, (10, frame.shape[0] - 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-                print(f"Saved frame {frame_count} to file")
-
-                display_frame = annotated_frame.copy()
-                cv2.imshow("Frame", display_frame)
-    
-                # Exit on 'q' key press
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
             except asyncio.TimeoutError:
                 print("Timeout waiting for frame, continuing...")
-            except Exception as e:
-                print(f"Error in handle_track: {str(e)}")
-                if "Connection" in str(e):
-                    break
-        print("Exiting handle_track")
+                continue
+            except MediaStreamError:
+                print("Track ended")
+                break
+            self.stats["receive"].record(0.0)
+            if isinstance(frame, VideoFrame):
+                self.to_convert.put(frame)
+            else:
+                print(f"Unexpected frame type: {type(frame)}")
+        self.stopped.set()
+
+    async def convert_stage(self):
+        while True:
+            frame = await self.to_convert.get()
+            img = await self._timed("convert", None, functools.partial(frame.to_ndarray, format="bgr24"))
+            if model is not None:
+                # Annotate draws on img, so inference converts its own array, and
+                # only for the frames it actually takes off the drop-oldest queue
+                self.to_infer.put(frame)
+            self.to_annotate.put(img)
+
+    async def infer_stage(self):
+        while True:
+            frame = await self.to_infer.get()
+            self.detections = await self._timed("infer", self.infer_executor, detect_frame, frame)
+
+    async def annotate_stage(self):
+        while True:
+            img = await self.to_annotate.get()
+            self.to_sink.put(await self._timed("annotate", None, annotate, img, self.detections))
+
+    async def sink_stage(self):
+        while True:
+            img = await self.to_sink.get()
+            if await self._timed("sink", self.sink_executor, show, img):
+                print("Quit requested")
+                self.stopped.set()
+
+    async def report_stats(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            stages = " | ".join(s.report(STATS_INTERVAL) for s in self.stats.values())
+            drops = " ".join(f"{q.name}:{q.dropped}" for q in self.queues)
+            print(f"[pipeline] {stages} | dropped {drops}")
+
+    async def handle_track(self, track):
+        print("Inside handle track")
+        self.track = track
+        tasks = [asyncio.create_task(coro) for coro in (
+            self.convert_stage(), self.infer_stage(), self.annotate_stage(),
+            self.sink_stage(), self.report_stats())]
+        try:
+            await self.receive_stage(track)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            print("Exiting handle_track")
+
+
 async def run(pc, signaling):
     await signaling.connect()
 
@@ -85,6 +254,8 @@ async def run(pc, signaling):
         print(f"Connection state is {pc.connectionState}")
         if pc.connectionState == "connected":
             print("WebRTC connection established successfully")
+        elif pc.connectionState in ["failed", "closed"]:
+            video_receiver.stopped.set()
 
     print("Waiting for offer from sender...")
     offer = await signaling.receive()
@@ -101,15 +272,20 @@ async def run(pc, signaling):
     print("Answer sent to sender")
 
     print("Waiting for connection to be established...")
-    while pc.connectionState != "connected":
+    while pc.connectionState != "connected" and not video_receiver.stopped.is_set():
         await asyncio.sleep(0.1)
 
-    print("Connection established, waiting for frames...")
-    await asyncio.sleep(100)  # Wait for 35 seconds to receive frames
+    print("Connection established, receiving frames until the stream ends...")
+    await video_receiver.stopped.wait()
 
     print("Closing connection")
 
 async def main():
+    await asyncio.start_server(handle_health, "0.0.0.0", HEALTH_PORT)
+    asyncio.create_task(load_model_in_background())
+    if loop_monitor is not None:
+        loop_monitor.start()
+
     signaling = TcpSocketSignaling("localhost", 9999)
     pc = RTCPeerConnection()
     
@@ -125,4 +301,9 @@ async def main():
         await pc.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if loop_monitor is not None:
+        loop_monitor.run(main())  # LOOP_RUNNER=uvloop to try uvloop
+        if loop_monitor.ENABLED:
+            print(loop_monitor.format_report())
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Recorded-file replay source for load testing.
+
+ReplayVideoTrack plays a video file as an aiortc track and can be dropped in
+wherever a CameraVideoTrack is created. Decoding runs in a background thread
+with PyAV's threaded decoding; frames are handed to the track through a
+bounded queue so the decoder never runs far ahead of the consumer.
+
+speed=1.0 replays in real time, speed=10 replays ten times faster, and
+speed=0 delivers as fast as the consumer can take frames. With loop=True the
+file restarts at EOF and timestamps keep increasing. With packets=True the
+already-encoded packets are forwarded without decoding (aiortc sends them
+as-is, so the file's codec must match the negotiated one): VP8 from IVF/WebM
+as stored, H264 run through the h264_mp4toannexb bitstream filter, since
+MP4/MKV store length-prefixed NAL units and aiortc only splits Annex-B start
+codes; the filter also puts SPS/PPS in front of every keyframe.
+
+The servers pick it up from the environment:
+    REPLAY_FILE=clip.mp4 REPLAY_SPEED=10 python3 servecv.py
+and ``python3 replay_source.py clip.mp4 --speed 0`` measures raw throughput.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+import av
+from aiortc.mediastreams import MediaStreamError, MediaStreamTrack
+
+QUEUE_SIZE = 8
+PACKET_CODECS = ("h264", "vp8")
+
+
+class ReplayVideoTrack(MediaStreamTrack):
+    kind = "video"
+
+    def __init__(self, path, speed=1.0, loop=True, packets=False):
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.packets = packets
+
+        self.frames_sent = 0
+        self.loops = 0
+        self._queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_wall = None
+        self._start_media = None
+
+    # ------------------------------------------------------------------
+    # Decode thread
+    # ------------------------------------------------------------------
+    def _decode_loop(self, loop):
+        container = av.open(self.path)
+        try:
+            stream = container.streams.video[0]
+            if not self.packets:
+                stream.thread_type = "AUTO"  # frame + slice threading in the decoder
+            annexb = None
+            if self.packets:
+                if stream.codec_context.name not in PACKET_CODECS:
+                    raise ValueError(f"packets mode needs H264 or VP8, not {stream.codec_context.name}")
+                if stream.codec_context.name == "h264":
+                    from av.bitstream import BitStreamFilterContext
+
+                    annexb = BitStreamFilterContext("h264_mp4toannexb", stream)
+            time_base = stream.time_base
+            frame_duration = int(1 / (stream.average_rate or 30) / time_base) or 1
+            offset = 0  # added to pts so looped playback stays monotonic
+            last_pts = 0
+
+            while not self._stop.is_set():
+                if self.packets:
+                    items = (p for p in container.demux(stream) if p.size and p.pts is not None)
+                    if annexb is not None:
+                        items = (out for p in items for out in annexb.filter(p))
+                else:
+                    items = (f for f in container.decode(stream) if f.pts is not None)
+
+                for item in items:
+                    if self._stop.is_set():
+                        return
+                    last_pts = item.pts
+                    item.pts += offset
+                    if self.packets and item.dts is not None:
+                        item.dts += offset  # kept apart from pts so B-frames stay valid
+                    item.time_base = time_base
+                    # Blocks while the queue is full: the consumer sets the pace
+                    if not self._put(item, loop):
+                        return
+
+                if not self.loop:
+                    break
+                offset += last_pts + frame_duration
+                self.loops += 1
+                container.seek(0, stream=stream)
+        except Exception as e:
+            print(f"Replay decode error: {e}")
+        finally:
+            container.close()
+            if not self._stop.is_set():
+                self._put(None, loop)
+
+    def _put(self, item, loop):
+        fut = asyncio.run_coroutine_threadsafe(self._queue.put(item), loop)
+        while True:
+            try:
+                fut.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self._stop.is_set():
+                    fut.cancel()
+                    return False
+
+    # ------------------------------------------------------------------
+    # Track API
+    # ------------------------------------------------------------------
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._decode_loop, args=(asyncio.get_running_loop(),), daemon=True
+            )
+            self._thread.start()
+
+        item = await self._queue.get()
+        if item is None:
+            self.stop()
+            raise MediaStreamError
+
+        # Packets arrive in decode order, so pace those by dts
+        clock = item.dts if self.packets and item.dts is not None else item.pts
+        media_time = float(clock * item.time_base)
+        if self._start_wall is None:
+            self._start_wall, self._start_media = time.monotonic(), media_time
+        if self.speed:
+            due = self._start_wall + (media_time - self._start_media) / self.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        self.frames_sent += 1
+        return item
+
+    def stop(self):
+        super().stop()
+        self._stop.set()
+
+
+def replay_from_env():
+    """Return a ReplayVideoTrack if REPLAY_FILE is set, else None."""
+    path = os.environ.get("REPLAY_FILE")
+    if not path:
+        return None
+    return ReplayVideoTrack(
+        path,
+        speed=float(os.environ.get("REPLAY_SPEED", "1")),
+        loop=os.environ.get("REPLAY_LOOP", "1") != "0",
+        packets=os.environ.get("REPLAY_PACKETS", "0") == "1",
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure replay throughput")
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=0, help="0 = as fast as possible")
+    parser.add_argument("--packets", action="store_true")
+    parser.add_argument("--frames", type=int, default=1000)
+    args = parser.parse_args()
+
+    async def bench():
+        track = ReplayVideoTrack(args.path, speed=args.speed, packets=args.packets)
+        t0 = time.perf_counter()
+        for _ in range(args.frames):
+            await track.recv()
+        elapsed = time.perf_counter() - t0
+        track.stop()
+        print(f"{args.frames} {'packets' if args.packets else 'frames'} in {elapsed:.2f}s "
+              f"= {args.frames / elapsed:.1f}/s ({track.loops} loops)")
+
+    asyncio.run(bench())
@@ -0,0 +1,81 @@
+"""
+Rate-limited structured logging for per-frame events.
+
+``event("frame_processed", stream="pi", frame=n)`` counts the occurrence and
+prints at most one JSON line per event name (and ``key``) every LOG_INTERVAL
+seconds, carrying how many occurrences it stands for and their rate:
+
+    {"ts": 1718000000.123, "event": "frame_processed", "count": 148,
+     "rate": 29.6, "stream": "pi", "frame": 1480}
+
+Counting is a dict lookup and an add, so the hot path no longer pays for
+formatting and writing a line per frame. A window is normally written by
+the first event after it ends; a background thread writes windows whose
+events have stopped coming, and whatever is left is written at exit, so
+the last counts before a stream stops aren't lost.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+LOG_INTERVAL = float(os.environ.get("LOG_INTERVAL", "5"))
+
+_windows = {}  # (event, key) -> [window start, count, latest fields]
+_lock = threading.Lock()
+_flusher = None
+
+
+def event(name, key=None, **fields):
+    now = time.monotonic()
+    with _lock:
+        window = _windows.get((name, key))
+        if window is None:
+            # First occurrence is always logged
+            _windows[(name, key)] = [now, 0, fields]
+            _emit(name, 1, None, fields)
+            _start_flusher()
+            return
+        window[1] += 1
+        window[2] = fields
+        elapsed = now - window[0]
+        if elapsed >= LOG_INTERVAL:
+            _emit(name, window[1], window[1] / elapsed, fields)
+            window[0], window[1] = now, 0
+
+
+def flush(stale_only=False):
+    """Write every window holding unlogged events (only those past LOG_INTERVAL if ``stale_only``)."""
+    now = time.monotonic()
+    with _lock:
+        for (name, _key), window in _windows.items():
+            elapsed = now - window[0]
+            if window[1] and (not stale_only or elapsed >= LOG_INTERVAL):
+                _emit(name, window[1], window[1] / max(elapsed, 1e-6), window[2])
+                window[0], window[1] = now, 0
+
+
+def _flush_forever():
+    while True:
+        time.sleep(LOG_INTERVAL)
+        flush(stale_only=True)
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_forever, name="sampled-log", daemon=True)
+        _flusher.start()
+
+
+def _emit(name, count, rate, fields):
+    record = {"ts": round(time.time(), 3), "event": name, "count": count}
+    if rate is not None:
+        record["rate"] = round(rate, 2)
+    record.update(fields)
+    sys.stdout.write(json.dumps(record, default=str) + "\n")
+
+
+atexit.register(flush)
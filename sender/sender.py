@@ -6,6 +6,11 @@ from av import VideoFrame
 import fractions
 from datetime import datetime
 
+try:
+    import sampled_log  # mounted from the repo root by docker-compose.yml
+except ImportError:
+    sampled_log = None
+
 class CustomVideoStreamTrack(VideoStreamTrack):
     def __init__(self, camera_id):
         super().__init__()
@@ -14,7 +19,8 @@ class CustomVideoStreamTrack(VideoStreamTrack):
 
     async def recv(self):
         self.frame_count += 1
-        print(f"Sending frame {self.frame_count}")
+        if sampled_log is not None:
+            sampled_log.event("frame_sent", frames=self.frame_count)
         ret, frame = self.cap.read()
         if not ret:
             print("Failed to read frame from camera")
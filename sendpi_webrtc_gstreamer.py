@@ -1,43 +1,106 @@
 #!/usr/bin/env python3
+# Pi camera via GStreamer appsink (no cv2.VideoCapture / extra videoconverts).
+#
+#   python3 sendpi_webrtc_gstreamer.py            # preview window
+#   python3 sendpi_webrtc_gstreamer.py --webrtc   # serve /offer on :5000
+#   add --test to use videotestsrc instead of the camera
 
+import argparse
+import asyncio
 import sys
-import gi
-import cv2
 
-gi.require_version("Gst", "1.0")
-from gi.repository import Gst
+import cv2
 
-# Initialize GStreamer
-Gst.init(None)
+from gst_source import GstFrameSource, GstVideoTrack, Gst, PI_CAMERA_SOURCE, TEST_SOURCE
 
 print("GStreamer version:", Gst.version_string())
 
-# Define GStreamer pipeline string for the camera
-pipeline_str = (
-    "libcamerasrc camera-name=/base/axi/pcie@1000120000/rp1/i2c@80000/imx500@1a ! "
-    "videoconvert ! queue ! "
-    "video/x-raw, pixel-aspect-ratio=1/1, format=YUY2, width=640, height=640, framerate=30/1 ! "
-    "queue ! videoconvert ! appsink"
-)
-
-# Open the video capture using the pipeline string
-cap = cv2.VideoCapture(pipeline_str, cv2.CAP_GSTREAMER)
-
-if not cap.isOpened():
-    print("Failed to open camera pipeline")
-    sys.exit(1)
-
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Failed to get frame")
-        break
-
-    cv2.imshow("Camera", frame)
-    
-    # Exit on 'q' key
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-cap.release()
-cv2.destroyAllWindows()
+FRAME_WIDTH, FRAME_HEIGHT = 640, 640
+
+
+def preview(source):
+    while True:
+        frame = source.pull("infer")
+        if frame is None:
+            print("Failed to get frame")
+            break
+
+        with frame:
+            cv2.imshow("Camera", frame.array)
+
+        # Exit on 'q' key
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+    cv2.destroyAllWindows()
+
+
+def serve_webrtc(source):
+    from quart import Quart, request, jsonify
+    from quart_cors import cors
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    app = Quart(__name__)
+    app = cors(app, allow_origin="*")
+    pcs = set()
+
+    @app.route("/offer", methods=["POST"])
+    async def offer():
+        params = await request.get_json()
+        offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
+
+        pc = RTCPeerConnection()
+        pcs.add(pc)
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            print("Connection state is", pc.connectionState)
+            if pc.connectionState in ["failed", "closed"]:
+                await pc.close()
+                pcs.discard(pc)
+
+        # I420 straight from the pipeline: the encoder needs no conversion
+        pc.addTrack(GstVideoTrack(source, "encode"))
+
+        await pc.setRemoteDescription(offer)
+        answer = await pc.createAnswer()
+        await pc.setLocalDescription(answer)
+
+        return jsonify({"sdp": pc.localDescription.sdp, "type": pc.localDescription.type})
+
+    config = Config()
+    config.bind = ["0.0.0.0:5000"]
+    asyncio.run(serve(app, config))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webrtc", action="store_true", help="serve the camera over WebRTC")
+    parser.add_argument("--test", action="store_true", help="use videotestsrc instead of the camera")
+    args = parser.parse_args()
+
+    # Each consumer gets the caps it wants: I420 for the encoder, BGR for display/inference
+    if args.webrtc:
+        branches = {"encode": ("I420", FRAME_WIDTH, FRAME_HEIGHT)}
+    else:
+        branches = {"infer": ("BGR", FRAME_WIDTH, FRAME_HEIGHT)}
+
+    source = GstFrameSource(TEST_SOURCE if args.test else PI_CAMERA_SOURCE, branches)
+    try:
+        source.start()
+    except RuntimeError as e:
+        print(f"Failed to open camera pipeline: {e}")
+        sys.exit(1)
+
+    for name in branches:
+        print(f"{name} caps:", source.negotiated_caps(name))
+
+    try:
+        if args.webrtc:
+            serve_webrtc(source)
+        else:
+            preview(source)
+    finally:
+        source.stop()
@@ -1,7 +1,8 @@
 import asyncio
+import os
+import threading
 import time
 import cv2
-import numpy as np
 from quart import Quart, request, jsonify
 from quart_cors import cors
 from aiortc import (
@@ -11,7 +12,12 @@ from aiortc import (
     RTCConfiguration,
     RTCIceServer,
 )
-from av import VideoFrame
+from replay_source import replay_from_env
+import alloc_profiler
+import loop_monitor
+from activity import ActivityGate, resync
+import peer_stats
+from snapshot import SnapshotCache
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
 
@@ -21,12 +27,16 @@ from hypercorn.config import Config
 print(f"[{time.strftime('%H:%M:%S')}] Initializing Quart app...")
 app = Quart(__name__)
 app = cors(app, allow_origin="*", allow_methods=["GET", "POST", "OPTIONS"], allow_headers=["Content-Type"])
+alloc_profiler.install(app)  # /debug/alloc, populated when ALLOC_PROFILE=1
+loop_monitor.install(app)  # /debug/loop, populated when LOOP_MONITOR=1
+peer_stats.install(app)  # /stats and /metrics: per-session getStats() numbers
 print(f"[{time.strftime('%H:%M:%S')}] Setup complete.")
 
 # -------------------------
 # Globals
 # -------------------------
 cap = None
+camera_lock = threading.Lock()  # cv2.VideoCapture isn't thread-safe: recv() and /snapshot share it
 streaming = False
 pcs = set()
 
@@ -46,34 +56,66 @@ def get_camera():
     return cap
 
 
+def read_camera():
+    with camera_lock:
+        return get_camera().read()
+
+
+# -------------------------
+# Snapshots for low-rate consumers (GET /snapshot)
+# -------------------------
+def capture_snapshot():
+    # Only used when no viewer is capturing
+    if not streaming:
+        return None
+    ret, img = read_camera()
+    return cv2.resize(img, (640, 480)) if ret else None
+
+
+snapshots = SnapshotCache(capture=capture_snapshot, color="bgr")
+snapshots.install(app)
+
+
 # -------------------------
 # Custom Video Track
 # -------------------------
 class CameraVideoTrack(VideoStreamTrack):
     def __init__(self):
         super().__init__()
+        self.activity = ActivityGate()  # IDLE_FPS while nothing in view moves
         print(f"[{time.strftime('%H:%M:%S')}] CameraVideoTrack initialized")
 
     async def recv(self):
         global streaming
         pts, time_base = await self.next_timestamp()
-        camera = get_camera()
+        get_camera()
 
         if not streaming:
             await asyncio.sleep(0.1)
-            blank = 255 * np.ones((480, 640, 3), dtype=np.uint8)
-            frame = VideoFrame.from_ndarray(blank, format="bgr24")
+            blank = alloc_profiler.new_frame((480, 640, 3), "idle", fill=255)
+            frame = alloc_profiler.from_ndarray(blank, "idle", format="bgr24")
             frame.pts = pts
             frame.time_base = time_base
             return frame
 
-        ret, img = camera.read()
+        while True:
+            # read() blocks until the next camera frame: keep it off the event loop
+            with alloc_profiler.stage("capture"):
+                ret, img = await asyncio.to_thread(read_camera)
+            if not ret:
+                break
+            with alloc_profiler.stage("resize"):
+                img = cv2.resize(img, (640, 480))
+            snapshots.update(img)
+            if self.activity.admit(img) or not streaming:
+                break
+            # Idle scene: keep checking every frame, but don't encode or send
         if not ret:
-            blank = 255 * np.ones((480, 640, 3), dtype=np.uint8)
-            frame = VideoFrame.from_ndarray(blank, format="bgr24")
+            blank = alloc_profiler.new_frame((480, 640, 3), "idle", fill=255)
+            frame = alloc_profiler.from_ndarray(blank, "idle", format="bgr24")
         else:
-            img = cv2.resize(img, (640, 480))
-            frame = VideoFrame.from_ndarray(img, format="bgr24")
+            frame = alloc_profiler.from_ndarray(img, "capture", format="bgr24")
+        pts = resync(self, pts)
 
         frame.pts = pts
         frame.time_base = time_base
@@ -89,7 +131,8 @@ async def start_stream():
     global streaming
     streaming = True
     print(f"[{time.strftime('%H:%M:%S')}] Stream started.")
-    get_camera()
+    if not os.environ.get("REPLAY_FILE"):
+        get_camera()
     return jsonify({"status": "stream started"})
 
 
@@ -126,12 +169,17 @@ async def offer():
 
     pc = RTCPeerConnection(configuration=rtc_config)
     pcs.add(pc)
+    # REPLAY_FILE swaps the camera for a recorded clip (load testing)
+    track = replay_from_env() or CameraVideoTrack()
+    activity = getattr(track, "activity", None)
+    peer_stats.track(pc, "viewer", counters=activity.counters if activity else None)
     print(f"[{time.strftime('%H:%M:%S')}] Created RTCPeerConnection")
 
     @pc.on("connectionstatechange")
     async def on_connectionstatechange():
         print(f"[{time.strftime('%H:%M:%S')}] Connection state: {pc.connectionState}")
         if pc.connectionState in ["failed", "closed", "disconnected"]:
+            track.stop()  # ends a replay track's decode thread and closes its file
             await pc.close()
             pcs.discard(pc)
             print(f"[{time.strftime('%H:%M:%S')}] Peer connection closed.")
@@ -141,7 +189,9 @@ async def offer():
         streaming = True
         print(f"[{time.strftime('%H:%M:%S')}] Auto-starting camera for new client...")
 
-    pc.addTrack(CameraVideoTrack())
+    sender = pc.addTrack(track)
+    if activity:
+        activity.request_keyframe = sender._send_keyframe
     print(f"[{time.strftime('%H:%M:%S')}] Added CameraVideoTrack to connection")
 
     await pc.setRemoteDescription(offer)
@@ -161,10 +211,11 @@ if __name__ == "__main__":
 
     # Pre-warm camera once on startup
     print(f"[{time.strftime('%H:%M:%S')}] Starting WebRTC server on port 5000...")
-    get_camera()
+    if not os.environ.get("REPLAY_FILE"):
+        get_camera()
 
     try:
-        asyncio.run(serve(app, config))
+        loop_monitor.run(serve(app, config))  # LOOP_RUNNER=uvloop to try uvloop
     finally:
         if cap and cap.isOpened():
             cap.release()
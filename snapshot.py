@@ -0,0 +1,123 @@
+"""
+Cheap JPEG snapshots of the latest captured frame for low-rate pollers.
+
+Capture paths call ``snapshots.update(frame)`` with whatever they just
+captured; that only stores a reference and bumps a sequence number. Encoding
+happens when a GET /snapshot arrives for a frame/size/quality that hasn't
+been encoded yet, once no matter how many requests are waiting on it. The
+ETag is keyed on the frame sequence number, so a poller sending
+If-None-Match gets a 304 with no body until there is a newer frame.
+
+When nothing is streaming (no viewer is driving capture), a request older
+than ``max_age`` triggers one capture through the ``capture`` callable.
+
+    GET /snapshot?width=320&quality=70
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+import cv2
+
+DEFAULT_QUALITY = 80
+CACHE_ENTRIES = 8
+
+
+class SnapshotCache:
+    def __init__(self, capture=None, color="bgr", max_age=1.0):
+        """
+        ``capture`` is a blocking callable returning a frame or None; ``color``
+        is the channel order of the frames passed to update() ("bgr" or "rgb").
+        """
+        self.capture = capture
+        self.color = color
+        self.max_age = max_age
+        self.frame = None
+        self.seq = 0
+        self.captured_at = 0.0
+        self.encodes = 0
+        self.requests = 0
+        self.not_modified = 0
+        self._cache = OrderedDict()  # (seq, width, quality) -> jpeg bytes
+        self._inflight = {}  # same key -> Future, so concurrent requests share one encode
+
+    def update(self, frame):
+        self.frame = frame
+        self.seq += 1
+        self.captured_at = time.monotonic()
+
+    async def latest(self):
+        if self.capture is not None and time.monotonic() - self.captured_at > self.max_age:
+            frame = await asyncio.to_thread(self.capture)
+            if frame is not None:
+                self.update(frame)
+        return self.seq, self.frame
+
+    def _encode(self, frame, width, quality):
+        if width and width < frame.shape[1]:
+            height = int(frame.shape[0] * width / frame.shape[1])
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        if self.color == "rgb":
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise RuntimeError("JPEG encode failed")
+        return buf.tobytes()
+
+    async def jpeg(self, seq, frame, width, quality):
+        key = (seq, width, quality)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if key in self._inflight:
+            return await self._inflight[key]
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await asyncio.to_thread(self._encode, frame, width, quality)
+            self.encodes += 1
+            self._cache[key] = data
+            while len(self._cache) > CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
+
+    def install(self, app, route="/snapshot"):
+        from quart import Response, jsonify, request
+
+        @app.route(route)
+        async def snapshot():
+            self.requests += 1
+            try:
+                width = request.args.get("width")
+                width = int(width) if width is not None else None
+                quality = min(100, max(1, int(request.args.get("quality", DEFAULT_QUALITY))))
+            except ValueError:
+                return jsonify({"error": "width and quality must be integers"}), 400
+            if width is not None and width <= 0:
+                return jsonify({"error": "width must be positive"}), 400
+
+            seq, frame = await self.latest()
+            if frame is None:
+                return jsonify({"error": "no frame captured yet"}), 503
+
+            etag = f'"{seq}-{width or 0}-{quality}"'
+            headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Frame-Seq": str(seq)}
+            if etag in request.headers.get("If-None-Match", ""):
+                self.not_modified += 1
+                return Response(b"", status=304, headers=headers)
+
+            data = await self.jpeg(seq, frame, width, quality)
+            return Response(data, mimetype="image/jpeg", headers=headers)
+
+        return app
+
+    def stats(self):
+        return {"seq": self.seq, "requests": self.requests,
+                "not_modified": self.not_modified, "encodes": self.encodes}
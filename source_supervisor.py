@@ -0,0 +1,128 @@
+"""
+Keeps an upstream WebRTC source (the Pi) connected.
+
+The supervisor owns the connect -> receive -> reconnect loop for one source.
+A stall is any gap longer than ``frame_timeout`` between frames on a
+connected session; a connect that fails or times out (the offer POST, the
+wait for the track) is counted separately as a connect failure. On either,
+or a track error, it closes the peer connection and retries
+with jittered exponential backoff. Consumers keep whatever they last got from
+``on_frame`` while it recovers, and the time from losing the source to the
+next received frame is recorded so mean-time-to-recover can be reported.
+"""
+import asyncio
+import random
+import time
+
+CONNECTING = "connecting"
+STREAMING = "streaming"
+BACKOFF = "backoff"
+
+
+class SourceSupervisor:
+    def __init__(self, name, open_session, on_frame, frame_timeout=5.0,
+                 backoff_initial=0.5, backoff_max=30.0, backoff_factor=2.0):
+        """
+        ``open_session`` is a coroutine function returning ``(pc, track)`` for a
+        fresh connection; ``on_frame`` is called with every received frame.
+        """
+        self.name = name
+        self.open_session = open_session
+        self.on_frame = on_frame
+        self.frame_timeout = frame_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.backoff_factor = backoff_factor
+
+        self.state = CONNECTING
+        self.frames = 0
+        self.sessions = 0
+        self.failures = 0
+        self.stalls = 0
+        self.connect_failures = 0
+        self.last_error = None
+        self.last_frame_at = None
+        self.down_since = time.monotonic()
+        self.recoveries = []  # seconds from source loss to first frame back
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff: uniform in [0, min(max, initial * factor**attempt)]."""
+        ceiling = min(self.backoff_max, self.backoff_initial * self.backoff_factor ** attempt)
+        return random.uniform(0, ceiling)
+
+    async def run(self):
+        attempt = 0
+        while True:
+            self.state = CONNECTING
+            pc = None
+            connected = False
+            try:
+                pc, track = await self.open_session()
+                connected = True
+                self.sessions += 1
+                while True:
+                    frame = await asyncio.wait_for(track.recv(), timeout=self.frame_timeout)
+                    self._frame_received()
+                    attempt = 0
+                    self.on_frame(frame)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                if connected:
+                    self.stalls += 1
+                    self._source_lost(f"no frame for {self.frame_timeout}s")
+                else:
+                    self.connect_failures += 1
+                    self._source_lost("connect failed: timed out")
+            except Exception as e:
+                if not connected:
+                    self.connect_failures += 1
+                    self._source_lost(f"connect failed: {type(e).__name__}: {e}")
+                else:
+                    self._source_lost(f"{type(e).__name__}: {e}")
+            finally:
+                if pc is not None:
+                    await pc.close()
+
+            delay = self.backoff(attempt)
+            attempt += 1
+            self.state = BACKOFF
+            print(f"🔁 [{self.name}] {self.last_error} — reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _frame_received(self):
+        now = time.monotonic()
+        if self.down_since is not None:
+            # The very first connect is startup, not a recovery
+            if self.last_frame_at is not None:
+                self.recoveries.append(now - self.down_since)
+                print(f"✅ [{self.name}] recovered in {now - self.down_since:.2f}s")
+            self.down_since = None
+        self.state = STREAMING
+        self.last_frame_at = now
+        self.frames += 1
+
+    def _source_lost(self, reason):
+        self.failures += 1
+        self.last_error = reason
+        if self.down_since is None:
+            # Count the outage from the last frame we actually got
+            self.down_since = self.last_frame_at or time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "state": self.state,
+            "frames": self.frames,
+            "sessions": self.sessions,
+            "failures": self.failures,
+            "stalls": self.stalls,
+            "connect_failures": self.connect_failures,
+            "last_error": self.last_error,
+            "seconds_since_frame": round(now - self.last_frame_at, 3) if self.last_frame_at else None,
+            "down_for": round(now - self.down_since, 3) if self.down_since is not None else 0.0,
+            "recoveries": len(self.recoveries),
+            "mttr_seconds": round(sum(self.recoveries) / len(self.recoveries), 3) if self.recoveries else None,
+            "last_recovery_seconds": round(self.recoveries[-1], 3) if self.recoveries else None,
+        }
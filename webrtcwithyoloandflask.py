@@ -1,4 +1,6 @@
 import asyncio
+import json
+import os
 import time
 import cv2
 import numpy as np
@@ -6,58 +8,279 @@ from quart import Quart, request, jsonify
 from quart_cors import cors
 
 from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
-from picamera2 import Picamera2
 from av import VideoFrame
-from ultralytics import YOLO  # Make sure ultralytics is installed: pip install ultralytics
+from readiness import Readiness, warmup_yolo
+import alloc_profiler
+import ptz
+import loop_monitor
+import peer_stats
+from detection_codec import DetectionChannels
 
 # Constants
 INFERENCE_EVERY_N_FRAMES = 5
+DRAW_BOXES = os.environ.get("DRAW_BOXES", "1") == "1"  # also burn boxes into the video
+FRAME_WIDTH, FRAME_HEIGHT = 1280, 720
+# YOLO reads the camera's lores stream: already at inference size, so the Pi
+# never resizes or converts a full frame for it. Keep the width a multiple of
+# 64 so the YUV420 rows have no stride padding.
+LORES_WIDTH, LORES_HEIGHT = 640, 360
+FAKE_CAMERA = os.environ.get("FAKE_CAMERA") == "1"  # test pattern instead of the Pi camera
+# When a server takes over inference for a connection (placement.py), the Pi
+# still times one inference this often so the server knows what it would cost
+PROBE_INTERVAL = 5.0
+EDGE_REPORT_INTERVAL = 1.0
+# Digital PTZ (ptz.py). PTZ=auto frames recent detections; viewers switch their
+# own connection with {"type": "ptz", "mode": "off"|"auto"|"manual",
+# "region": [x, y, w, h]} (normalized) on the reliable "control" data channel,
+# and the Pi replies with the mode now in effect. The sensor's
+# ScalerCrop is used while there is a single viewer, since it crops the camera
+# for everyone; with more viewers each one gets a software crop.
+PTZ_MODE = os.environ.get("PTZ", "off")
+PTZ_HARDWARE = os.environ.get("PTZ_HARDWARE", "1") == "1"
+LORES_NORM = np.array([LORES_WIDTH, LORES_HEIGHT] * 2, dtype=np.float32)
 
 # Initialize app
 app = Quart(__name__)
 app = cors(app, allow_origin="*")
+readiness = Readiness("camera", "model")
+readiness.install(app)
+alloc_profiler.install(app)  # /debug/alloc, populated when ALLOC_PROFILE=1
+loop_monitor.install(app)  # /debug/loop, populated when LOOP_MONITOR=1
+peer_stats.install(app)  # /stats and /metrics: per-session getStats() numbers
 
-# Initialize Picamera2
-picam2 = Picamera2()
-picam2.configure(
-    picam2.create_preview_configuration(
-        main={"format": "RGB888", "size": (1280, 720)}
-    )
-)
-picam2.start()
-time.sleep(1)  # Allow camera to warm up
+# Camera and model are loaded in the background once the server is bound
+picam2 = None
+model = None
+active_tracks = set()
+sensor_crop_owner = None  # the track whose ScalerCrop is applied, if any
 
-# Load YOLOv8n model
-model = YOLO("yolov8n.pt")  # You can replace with another model path
+loading_frame = np.zeros((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+cv2.putText(loading_frame, "Camera starting...", (50, FRAME_HEIGHT // 2),
+            cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+
+
+def load_camera():
+    global picam2
+    if FAKE_CAMERA:
+        from fake_camera import FakePicamera2 as Picamera2
+    else:
+        from picamera2 import Picamera2
+
+    cam = Picamera2()
+    try:
+        cam.configure(
+            cam.create_preview_configuration(
+                main={"format": "RGB888", "size": (FRAME_WIDTH, FRAME_HEIGHT)},
+                lores={"format": "YUV420", "size": (LORES_WIDTH, LORES_HEIGHT)},
+            )
+        )
+        cam.start()
+        time.sleep(1)  # Allow camera to warm up
+        cam.capture_array()  # First capture is the slow one
+    except Exception:
+        # Release the device, or every retry fails with "camera in use"
+        cam.close()
+        raise
+    picam2 = cam
+    return cam
+
+
+def sensor_fov():
+    """ScalerCropMaximum when the camera can crop in hardware, else None."""
+    if not PTZ_HARDWARE or "ScalerCrop" not in picam2.camera_controls:
+        return None
+    return tuple(picam2.camera_properties["ScalerCropMaximum"])
+
+
+def reset_sensor_crop():
+    global sensor_crop_owner
+    picam2.set_controls({"ScalerCrop": picam2.camera_controls["ScalerCrop"][2]})
+    sensor_crop_owner = None
+
+
+def load_model():
+    global model
+    from ultralytics import YOLO  # Make sure ultralytics is installed: pip install ultralytics
+
+    yolo = YOLO("yolov8n.pt")  # You can replace with another model path
+    warmup_yolo(yolo, (LORES_HEIGHT, LORES_WIDTH, 3))
+    model = yolo
+    return yolo
 
 # Video stream track
 class CameraVideoTrack(VideoStreamTrack):
-    def __init__(self):
+    def __init__(self, detection_channels=None):
         super().__init__()
         self.frame_count = 0
-        self.last_result = None
+        self.last_boxes = None  # (xyxy normalized to the field of view, classes, confidences)
+        self.detection_channels = detection_channels
+        self.ptz = None  # ptz.CropController, created once the camera is up
+        self.ptz_mode = PTZ_MODE
+        self.ptz_region = None
+        self.sensor_crop = None  # last ScalerCrop this track asked for
+        active_tracks.add(self)
+        self.placement = "edge"  # a server on the other end can move inference to itself
+        self.infer_seconds = None
+        self.frame_interval = None
+        self.last_frame_at = None
+        self.last_infer_at = 0.0
+        self.last_report_at = 0.0
+
+    def on_control(self, msg, channel):
+        if msg.get("type") == "placement" and msg.get("mode") in ("edge", "server"):
+            if msg["mode"] != self.placement:
+                print(f"🔀 Inference placement for this viewer: {msg['mode']}")
+                self.placement = msg["mode"]
+                self.last_boxes = None
+        elif msg.get("type") == "ptz":
+            # No mode just asks for the current one; the reply doubles as the ack
+            if msg.get("mode") in ptz.MODES:
+                region = msg.get("region")
+                if region is not None:
+                    region = ptz.parse_region(region)
+                    if region is None:
+                        print(f"⚠️ Ignoring PTZ message with a bad region: {msg.get('region')!r}")
+                        return
+                self.ptz_mode, self.ptz_region = msg["mode"], region
+                if self.ptz is not None:
+                    self.ptz.set_mode(self.ptz_mode, self.ptz_region)
+            elif msg.get("mode") is not None:
+                return
+            if channel.readyState == "open":
+                channel.send(json.dumps({"type": "ptz", "mode": self.ptz_mode}))
+        elif msg.get("type") == "ping" and channel.readyState == "open":
+            channel.send(json.dumps({"type": "pong", "t": msg["t"]}))
+
+    def report_edge_stats(self, now):
+        if self.detection_channels is None or self.infer_seconds is None:
+            return
+        if now - self.last_report_at < EDGE_REPORT_INTERVAL:
+            return
+        self.last_report_at = now
+        self.detection_channels.send_json({
+            "type": "edge_stats",
+            "mode": self.placement,
+            "infer_ms": round(self.infer_seconds * 1000, 1),
+            "interval_ms": round(INFERENCE_EVERY_N_FRAMES * (self.frame_interval or 1 / 30) * 1000, 1),
+        })
+
+    def stop(self):
+        super().stop()
+        active_tracks.discard(self)
+        if sensor_crop_owner is self:
+            reset_sensor_crop()
+
+    def apply_ptz(self, frame, shown, fov, now):
+        """Crop for this frame; returns (frame to send, part of the field of view it shows)."""
+        global sensor_crop_owner
+        if self.ptz is None:
+            fov_aspect = fov[2] / fov[3] if fov is not None else FRAME_WIDTH / FRAME_HEIGHT
+            self.ptz = ptz.CropController(FRAME_WIDTH / FRAME_HEIGHT, fov_aspect)
+            self.ptz.set_mode(self.ptz_mode, self.ptz_region)
+        crop = self.ptz.step(now)
+
+        if self.ptz_mode == "off" and self.ptz.is_full(crop):
+            # Eased back out; recv stops calling this from the next frame, so
+            # give the sensor its default crop now rather than leave it slightly in
+            if sensor_crop_owner is self:
+                reset_sensor_crop()
+                self.sensor_crop = None
+            return frame, shown
+
+        if fov is not None and active_tracks == {self}:
+            # The ISP crops and scales; frames show the new crop a few frames later
+            sensor = ptz.to_sensor(crop, fov)
+            if self.sensor_crop is None or max(abs(a - b) for a, b in zip(sensor, self.sensor_crop)) > fov[2] * 0.005:
+                picam2.set_controls({"ScalerCrop": sensor})
+                self.sensor_crop = sensor
+                sensor_crop_owner = self
+            return frame, shown
+
+        if sensor_crop_owner is self:
+            # Another viewer joined: give the whole sensor back and crop in software
+            reset_sensor_crop()
+            self.sensor_crop = None
+        rel = ptz.relative(crop, shown)
+        if all(abs(a - b) < 1e-3 for a, b in zip(rel, ptz.FULL)):
+            return frame, shown
+        with alloc_profiler.stage("crop"):
+            frame = ptz.software_crop(frame, rel, FRAME_WIDTH, FRAME_HEIGHT)
+        return frame, ptz.absolute(rel, shown)
 
     async def recv(self):
         self.frame_count += 1
         pts, time_base = await self.next_timestamp()
 
-        # Capture frame
-        frame = picam2.capture_array()
+        if picam2 is None:
+            video_frame = VideoFrame.from_ndarray(loading_frame, format="rgb24")
+            video_frame.pts = pts
+            video_frame.time_base = time_base
+            return video_frame
 
-        # Convert to BGR for OpenCV
-        bgr_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        now = time.monotonic()
+        if self.last_frame_at is not None:
+            interval = now - self.last_frame_at
+            self.frame_interval = interval if self.frame_interval is None else \
+                self.frame_interval + 0.2 * (interval - self.frame_interval)
+        self.last_frame_at = now
+        run_inference = model is not None and self.frame_count % INFERENCE_EVERY_N_FRAMES == 0 and (
+            self.placement == "edge" or now - self.last_infer_at >= PROBE_INTERVAL)
 
-        # Perform inference every N frames
-        if self.frame_count % INFERENCE_EVERY_N_FRAMES == 0:
-            results = model(bgr_frame, verbose=False)
-            self.last_result = results[0]
+        # Capture main (for the encoder) and, when needed, lores (for YOLO)
+        # from the same request so boxes line up with the frame they came from
+        fov = sensor_fov()
+        with alloc_profiler.stage("capture"):
+            capture = picam2.capture_request()
+            try:
+                frame = capture.make_array("main")
+                lores = capture.make_array("lores") if run_inference else None
+                metadata = capture.get_metadata() if fov is not None else {}
+            finally:
+                capture.release()
+        # Part of the field of view both arrays show (less than all of it under ScalerCrop)
+        shown = ptz.from_sensor(metadata["ScalerCrop"], fov) if "ScalerCrop" in metadata else ptz.FULL
 
-        # Draw results if available
-        if self.last_result:
-            for box in self.last_result.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                conf = float(box.conf[0])
-                cls = int(box.cls[0])
+        # Perform inference every N frames on the small stream
+        if run_inference:
+            with alloc_profiler.stage("convert"):
+                small_bgr = cv2.cvtColor(lores, cv2.COLOR_YUV2BGR_I420)
+            with alloc_profiler.stage("infer"):
+                t0 = time.monotonic()
+                boxes = model(small_bgr, verbose=False)[0].boxes
+                elapsed = time.monotonic() - t0
+            self.infer_seconds = elapsed if self.infer_seconds is None else \
+                self.infer_seconds + 0.2 * (elapsed - self.infer_seconds)
+            self.last_infer_at = now
+            if self.placement == "edge":
+                self.last_boxes = (
+                    ptz.to_fov(boxes.xyxy.cpu().numpy() / LORES_NORM, shown),
+                    boxes.cls.cpu().numpy().astype(int),
+                    boxes.conf.cpu().numpy(),
+                )
+                if self.ptz is not None:
+                    self.ptz.observe(self.last_boxes[0], now)
+        self.report_edge_stats(now)
+
+        view = shown
+        if self.ptz_mode != "off" or (self.ptz is not None and not self.ptz.is_full()):
+            frame, view = self.apply_ptz(frame, shown, fov, now)
+
+        # Boxes in the pixels of the frame actually sent
+        sent_boxes = None
+        if self.last_boxes is not None:
+            xyxy, visible = ptz.to_view(self.last_boxes[0], view, frame.shape[1], frame.shape[0])
+            sent_boxes = (xyxy, self.last_boxes[1][visible], self.last_boxes[2][visible])
+
+        if sent_boxes is not None and self.detection_channels is not None:
+            self.detection_channels.set_names(model.names)
+            self.detection_channels.broadcast(pts, frame.shape[1], frame.shape[0], *sent_boxes)
+
+        # Draw results if available (optional: browsers get them on the data channel)
+        if DRAW_BOXES and sent_boxes is not None and len(sent_boxes[1]):
+            with alloc_profiler.stage("convert"):
+                bgr_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            for xyxy, cls, conf in zip(*sent_boxes):
+                x1, y1, x2, y2 = map(int, xyxy)
                 label = model.names[cls]
 
                 cv2.rectangle(bgr_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
@@ -71,11 +294,12 @@ class CameraVideoTrack(VideoStreamTrack):
                     1,
                 )
 
-        # Convert back to RGB
-        rgb_frame = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB)
+            # Convert back to RGB
+            with alloc_profiler.stage("convert"):
+                frame = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB)
 
         # Create VideoFrame
-        video_frame = VideoFrame.from_ndarray(rgb_frame, format="rgb24")
+        video_frame = alloc_profiler.from_ndarray(frame, "encode", format="rgb24")
         video_frame.pts = pts
         video_frame.time_base = time_base
 
@@ -95,10 +319,18 @@ async def offer():
     async def on_connectionstatechange():
         print("Connection state is", pc.connectionState)
         if pc.connectionState in ["failed", "closed"]:
+            track.stop()
             await pc.close()
             pcs.discard(pc)
 
-    pc.addTrack(CameraVideoTrack())
+    # Detections go out on the browser's "detections" data channel, tagged with
+    # the pts of the frame they belong to (see detection_codec.py)
+    detection_channels = DetectionChannels()
+    detection_channels.attach(pc)
+    track = CameraVideoTrack(detection_channels)
+    peer_stats.track(pc, "viewer", counters=lambda: {"frames_sent": track.frame_count})
+    detection_channels.on_control = track.on_control
+    pc.addTrack(track)
 
     await pc.setRemoteDescription(offer)
     answer = await pc.createAnswer()
@@ -106,10 +338,15 @@ async def offer():
 
     return jsonify({"sdp": pc.localDescription.sdp, "type": pc.localDescription.type})
 
+@app.before_serving
+async def start_background_loading():
+    asyncio.create_task(readiness.load("camera", load_camera, retry_delay=5))
+    asyncio.create_task(readiness.load("model", load_model, retry_delay=10))
+
 if __name__ == "__main__":
     import hypercorn.asyncio
     from hypercorn.config import Config
 
     config = Config()
     config.bind = ["0.0.0.0:5000"]
-    asyncio.run(hypercorn.asyncio.serve(app, config))
+    loop_monitor.run(hypercorn.asyncio.serve(app, config))  # LOOP_RUNNER=uvloop to try uvloop